@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+# startup measures how long short runs of ck2_parser take before any input is read.
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+# Usage: python benchmarks/startup.py [runs]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def time_process(code, runs) :
+    # Best wall time of a fresh interpreter running code
+    best = None
+    for i in range(runs) :
+        start = time.time()
+        subprocess.check_call([sys.executable, "-c", code], cwd = repo)
+        elapsed = time.time() - start
+        if best is None or elapsed < best :
+            best = elapsed
+    return best
+
+def main(argv) :
+    runs = 10
+    if argv :
+        runs = int(argv[0])
+    directory = tempfile.mkdtemp()
+    db = os.path.join(directory, "startup.db")
+    try :
+        cases = [
+            ("interpreter", "pass"),
+            ("import ck2_parser", "import ck2_parser"),
+            ("import command_line", "import ck2_parser.command_line"),
+            ("ck2_parser, new schema", "import os, sqlite3; from ck2_parser import ck2_parser; "
+                "os.path.exists(%r) and os.remove(%r); ck2_parser(sqlite3.connect(%r))" % (db, db, db)),
+            ("ck2_parser, current schema", "import sqlite3; from ck2_parser import ck2_parser; "
+                "ck2_parser(sqlite3.connect(%r))" % (db)),
+        ]
+        print "best of %i runs, %s" % (runs, sys.version.split()[0])
+        for name, code in cases :
+            print "%-28s %8.1f ms" % (name, time_process(code, runs) * 1000)
+    finally :
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1 +1,29 @@
-from .ck2_file_parser import ck2_parser
+import sys
+import types
+import importlib
+
+# Public names and the submodule defining them. Submodules are imported on
+# first access, so importing the package doesn't load the parser, sqlite3
+# or numpy until they are needed.
+lazy_names = {
+    'ck2_parser' : 'ck2_file_parser',
+}
+
+__all__ = sorted(lazy_names.keys())
+
+class lazy_module(types.ModuleType) :
+    def __getattribute__(self, name) :
+        if name in lazy_names :
+            value = self.__dict__.get(name)
+            if value is None :
+                module = importlib.import_module("." + lazy_names[name], self.__name__)
+                value = getattr(module, name)
+                self.__dict__[name] = value
+            return value
+        return types.ModuleType.__getattribute__(self, name)
+
+module = lazy_module(__name__, __doc__)
+module.__dict__.update(dict((name, value) for name, value in globals().items() if name not in lazy_names))
+# Keep the original module alive, its globals are used by lazy_module
+module.__dict__['_original_module'] = sys.modules[__name__]
+sys.modules[__name__] = module
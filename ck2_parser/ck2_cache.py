@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+# ck2_cache keeps the results of repeated lookups in memory.
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from collections import OrderedDict
+
+
+class lru_cache :
+    """
+        lru_cache is a dict-like store that keeps at most max_size entries,
+        dropping the least recently used one when full.
+
+        max_size : number of entries to keep
+    """
+    def __init__(self, max_size = 1024) :
+        self.max_size = max(1, max_size)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default = None) :
+        with self.lock :
+            try :
+                value = self.entries.pop(key)
+            except KeyError :
+                self.misses += 1
+                return default
+            # Reinsert to mark the entry as the most recently used
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value) :
+        with self.lock :
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.max_size :
+                self.entries.popitem(last = False)
+
+    def fetchall(self, conn, key, sql, params = ()) :
+        """ Returns the rows of sql run on conn, cached under key. """
+        result = self.get(key)
+        if result is None :
+            result = conn.execute(sql, params).fetchall()
+            self.put(key, result)
+        return result
+
+    def clear(self) :
+        with self.lock :
+            self.entries.clear()
+
+    def __contains__(self, key) :
+        return key in self.entries
+
+    def __len__(self) :
+        return len(self.entries)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+# ck2_columnar exports loaded CK2 tables as NumPy column arrays.
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+
+import numpy as np
+
+# Layout of an exported table, one directory per table:
+#   meta.json : row count, and the kind of every column
+#   <column>.npy : int64 or float64 values, or int32 codes for strings (-1 is NULL)
+#   <column>.mask.npy : True where an int column is not NULL
+#   <column>.dict.npy : strings of a string column, indexed by its codes
+
+def merge_kind(kind, value) :
+    # Kind of a column of kind once value is added: 'int', 'float' or 'str'
+    if value is None or kind == 'str' :
+        return kind
+    if isinstance(value, float) :
+        return 'float'
+    if isinstance(value, (int, long)) :
+        return kind
+    if kind == 'int' :
+        try :
+            int(value)
+            return 'int'
+        except (ValueError, TypeError) :
+            pass
+    try :
+        float(value)
+        return 'float'
+    except (ValueError, TypeError) :
+        return 'str'
+
+def get_kind(values) :
+    kind = 'int'
+    for value in values :
+        kind = merge_kind(kind, value)
+    return kind
+
+def new_array(path, dtype, size) :
+    # open_memmap writes the array to path as it is filled
+    return np.lib.format.open_memmap(path, mode = 'w+', dtype = dtype, shape = (size,))
+
+class ck2_column_writer :
+    """
+        ck2_column_writer writes rows of a table to typed column arrays in
+        directory. The arrays are preallocated with open_memmap and filled
+        batch by batch, so rows are never held in memory. The kinds of the
+        columns and the number of rows must be known beforehand, export_table
+        finds them with a first pass over the table.
+
+        directory : directory of the exported table
+        columns : list of column names
+        kinds : dict of column name -> 'int', 'float' or 'str'
+        size : number of rows
+    """
+    def __init__(self, directory, columns, kinds, size) :
+        if not os.path.isdir(directory) :
+            os.makedirs(directory)
+        self.directory = directory
+        self.columns = list(columns)
+        self.kinds = dict((column, kinds[column]) for column in self.columns)
+        self.size = size
+        self.row_count = 0
+        self.arrays = {}
+        self.masks = {}
+        self.strings = {}
+        for column in self.columns :
+            path = os.path.join(directory, column)
+            kind = self.kinds[column]
+            if kind == 'int' :
+                self.arrays[column] = new_array(path + ".npy", np.int64, size)
+                self.masks[column] = new_array(path + ".mask.npy", np.bool_, size)
+            elif kind == 'float' :
+                self.arrays[column] = new_array(path + ".npy", np.float64, size)
+            else :
+                self.arrays[column] = new_array(path + ".npy", np.int32, size)
+                self.strings[column] = {}
+
+    def add_rows(self, rows) :
+        """ Writes a batch of rows, dicts or tuples in the order of columns. """
+        start = self.row_count
+        end = start + len(rows)
+        if end > self.size :
+            raise ValueError("%s: more than the %i rows expected" % (self.directory, self.size))
+        rows = [[row.get(column) for column in self.columns] if isinstance(row, dict) else row for row in rows]
+        for i, column in enumerate(self.columns) :
+            values = [row[i] for row in rows]
+            kind = self.kinds[column]
+            if kind == 'int' :
+                self.masks[column][start:end] = [value is not None for value in values]
+                self.arrays[column][start:end] = [int(value) if value is not None else 0 for value in values]
+            elif kind == 'float' :
+                self.arrays[column][start:end] = [float(value) if value is not None else np.nan for value in values]
+            else :
+                strings = self.strings[column]
+                self.arrays[column][start:end] = [strings.setdefault(value, len(strings)) if value is not None else -1 for value in values]
+        self.row_count = end
+
+    def add_row(self, row) :
+        self.add_rows([row])
+
+    def close(self) :
+        if self.row_count != self.size :
+            raise ValueError("%s: %i rows written, %i expected" % (self.directory, self.row_count, self.size))
+        for column in self.columns :
+            path = os.path.join(self.directory, column)
+            self.arrays[column].flush()
+            if column in self.masks :
+                mask = self.masks[column]
+                mask.flush()
+                complete = bool(mask.all())
+                del mask
+                del self.masks[column]
+                # A mask is only kept when the column has NULLs
+                if complete :
+                    os.remove(path + ".mask.npy")
+            if column in self.strings :
+                strings = self.strings[column]
+                dictionary = sorted(strings.keys(), key = lambda x: strings[x])
+                np.save(path + ".dict.npy", np.array(dictionary, dtype = np.unicode_))
+        self.arrays = {}
+        with open(os.path.join(self.directory, "meta.json"), "w") as f :
+            json.dump({'rows' : self.row_count, 'columns' : self.columns, 'kinds' : self.kinds}, f)
+        print "Saved %i rows to %s" % (self.row_count, self.directory)
+
+def scan_table(dbconn, table_name, batch_size = 10000) :
+    """ Returns the columns of table_name, their kinds and the number of rows. """
+    cursor = dbconn.execute("SELECT * FROM %s" % (table_name))
+    columns = [description[0] for description in cursor.description]
+    kinds = ['int'] * len(columns)
+    row_count = 0
+    rows = cursor.fetchmany(batch_size)
+    while rows :
+        for row in rows :
+            for i, value in enumerate(row) :
+                kinds[i] = merge_kind(kinds[i], value)
+        row_count += len(rows)
+        rows = cursor.fetchmany(batch_size)
+    return columns, dict(zip(columns, kinds)), row_count
+
+def export_table(dbconn, table_name, directory, batch_size = 10000) :
+    """
+        Saves table_name to directory/table_name as column arrays, in two
+        passes over the table: one for the kinds and the number of rows, one
+        to write them. The table must not change in between.
+    """
+    columns, kinds, row_count = scan_table(dbconn, table_name, batch_size)
+    writer = ck2_column_writer(os.path.join(directory, table_name), columns, kinds, row_count)
+    cursor = dbconn.execute("SELECT * FROM %s" % (table_name))
+    rows = cursor.fetchmany(batch_size)
+    while rows :
+        writer.add_rows(rows)
+        rows = cursor.fetchmany(batch_size)
+    writer.close()
+
+def export_tables(dbconn, directory, tables = ['character', 'title', 'claim']) :
+    for table_name in tables :
+        export_table(dbconn, table_name, directory)
+
+class ck2_columns :
+    """
+        ck2_columns opens a table exported by export_table. Columns are
+        memory mapped, so opening is immediate and only the pages read are
+        loaded.
+
+        columns["culture"] : codes (or values) of a column
+        get_strings("culture") : strings of a string column, None for NULL
+        get_mask("id") : True where an int column is not NULL
+
+        directory : directory of the exported table
+        mmap : memory map the arrays instead of reading them
+    """
+    def __init__(self, directory, mmap = True) :
+        self.directory = directory
+        self.mmap_mode = 'r' if mmap else None
+        with open(os.path.join(directory, "meta.json")) as f :
+            meta = json.load(f)
+        self.row_count = meta['rows']
+        self.names = meta['columns']
+        self.kinds = meta['kinds']
+        self.arrays = {}
+
+    def load(self, name, suffix = ".npy") :
+        key = name + suffix
+        if key not in self.arrays :
+            self.arrays[key] = np.load(os.path.join(self.directory, key), mmap_mode = self.mmap_mode)
+        return self.arrays[key]
+
+    def __getitem__(self, name) :
+        if name not in self.kinds :
+            raise KeyError(name)
+        return self.load(name)
+
+    def __len__(self) :
+        return self.row_count
+
+    def get_dictionary(self, name) :
+        return self.load(name, ".dict.npy")
+
+    def get_mask(self, name) :
+        if self.kinds[name] == 'str' :
+            return self[name] >= 0
+        elif self.kinds[name] == 'float' :
+            return ~np.isnan(self[name])
+        elif os.path.exists(os.path.join(self.directory, name + ".mask.npy")) :
+            return self.load(name, ".mask.npy")
+        return np.ones(self.row_count, dtype = np.bool_)
+
+    def get_strings(self, name) :
+        codes = np.asarray(self[name])
+        strings = np.asarray(self.get_dictionary(name), dtype = object)
+        result = np.empty(len(codes), dtype = object)
+        known = codes >= 0
+        result[known] = strings[codes[known]]
+        return result
+
+def load_table(directory, table_name, mmap = True) :
+    return ck2_columns(os.path.join(directory, table_name), mmap)
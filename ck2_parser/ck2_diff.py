@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+# ck2_diff compares two CK2 saved games and records what changed between them.
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+from .ck2_file_parser import ck2_parser, flat_dict
+
+
+class ck2_entity_reader(ck2_parser) :
+    """
+        ck2_entity_reader parses a saved game without a database and
+        streams its entities grouped by top level section. parse_file
+        keeps every entity of the file in self.entities instead.
+    """
+    def __init__(self) :
+        ck2_parser.__init__(self, None)
+        self.entities = []
+
+    def get_entity_key(self, tag) :
+        if tag == "character_element" :
+            return "character", self.get_value_from_dict("id")
+        elif tag == "claim" :
+            character_id = self.get_value_from_dict("id", 1)
+            return "claim", "%s:%s" % (character_id, self.get_value_from_dict("title"))
+        elif tag == "dynasties_element" :
+            return "dynasty", self.get_value_from_dict("id")
+        elif tag == "historic_dynasties_element" :
+            return "historic_dynasty", self.get_value_from_dict("id")
+        elif tag == "historic_character_element" :
+            return "historic_character", self.get_value_from_dict("id")
+        elif tag == "title_element" :
+            return "title", self.get_value_from_dict("title_id")
+        elif tag == "CK2_Save_game_element" :
+            return "province", self.get_value_from_dict("id")
+        return None, None
+
+    def save_element_to_db(self, dict = None, tag = None) :
+        tag = self.get_parent_tag(0)
+        entity_type, entity_id = self.get_entity_key(tag)
+        if entity_type and entity_id :
+            if len(self.tag_stack) > 1 :
+                section = self.tag_stack[1]
+            else :
+                section = tag
+            self.entities.append((section, entity_type, entity_id, flat_dict(self.get_parent_dict(0))))
+
+    def read_sections(self, path, root = "CK2_Save_game") :
+        """
+            Yields (section, entities) for each run of entities sharing a top
+            level section. entities maps (entity type, id) to the flat fields.
+            Only one section is kept in memory at a time.
+        """
+        self.start_file(root)
+        section = None
+        entities = {}
+        for offset in self.read_lines(path) :
+            for entity_section, entity_type, entity_id, fields in self.entities :
+                if entity_section != section :
+                    if entities :
+                        yield section, entities
+                    section = entity_section
+                    entities = {}
+                entities[(entity_type, entity_id)] = fields
+            del self.entities[:]
+        if entities :
+            yield section, entities
+
+def diff_entities(old_entities, new_entities) :
+    """
+        Yields (entity type, entity id, change, field, old value, new value)
+        events. change is 'added', 'removed' or 'changed'. Field level events
+        are only produced for changed entities.
+    """
+    for key in sorted(old_entities.keys()) :
+        if key not in new_entities :
+            yield key[0], key[1], 'removed', None, None, None
+    for key in sorted(new_entities.keys()) :
+        new_fields = new_entities[key]
+        old_fields = old_entities.get(key)
+        if old_fields is None :
+            yield key[0], key[1], 'added', None, None, None
+            continue
+        for field in sorted(set(old_fields.keys()) | set(new_fields.keys())) :
+            old_value = old_fields.get(field)
+            new_value = new_fields.get(field)
+            if old_value != new_value :
+                yield key[0], key[1], 'changed', field, old_value, new_value
+
+class ck2_diff :
+    """
+        ck2_diff reads two saved games side by side and writes the added,
+        removed and changed entities to the save_diff table of dbconn.
+
+        Sections are matched by name. A section found in one save only waits
+        in memory until the other save reaches it.
+
+        dbconn : sqlite3 connection of the output database
+        drop_tables : clear the save_diff table before writing
+    """
+    fields = ['old_file', 'new_file', 'entity_type', 'entity_id', 'change', 'field', 'old_value', 'new_value']
+
+    def __init__(self, dbconn, drop_tables = False) :
+        self.conn = dbconn
+        self.c = self.conn.cursor()
+        if drop_tables :
+            self.c.execute("DROP TABLE IF EXISTS save_diff")
+        self.c.execute("CREATE TABLE IF NOT EXISTS save_diff (%s)" % (", ".join(self.fields)))
+        self.conn.commit()
+        self.change_count = 0
+
+    def write_changes(self, old_path, new_path, old_entities, new_entities) :
+        rows = [(old_path, new_path) + event for event in diff_entities(old_entities, new_entities)]
+        if rows :
+            self.c.executemany("INSERT INTO save_diff (%s) VALUES (%s)" % (", ".join(self.fields), ", ".join("?" * len(self.fields))), rows)
+            self.conn.commit()
+            self.change_count += len(rows)
+
+    def diff_files(self, old_path, new_path, root = "CK2_Save_game") :
+        old_reader = ck2_entity_reader().read_sections(old_path, root)
+        new_reader = ck2_entity_reader().read_sections(new_path, root)
+        pending = {'old' : {}, 'new' : {}}
+        readers = [('old', old_reader), ('new', new_reader)]
+
+        while readers :
+            for side, reader in list(readers) :
+                try :
+                    section, entities = next(reader)
+                except StopIteration :
+                    readers.remove((side, reader))
+                    continue
+                pending[side].setdefault(section, {}).update(entities)
+
+            for section in list(pending['old'].keys()) :
+                if section in pending['new'] :
+                    print "Comparing section %s" % (section)
+                    self.write_changes(old_path, new_path, pending['old'].pop(section), pending['new'].pop(section))
+
+        # Sections left are only in one of the saves
+        for section, entities in pending['old'].items() :
+            self.write_changes(old_path, new_path, entities, {})
+        for section, entities in pending['new'].items() :
+            self.write_changes(old_path, new_path, {}, entities)
+
+        print "Found %i changes between %s and %s" % (self.change_count, old_path, new_path)
+        return self.change_count
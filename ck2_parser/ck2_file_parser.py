@@ -20,47 +20,107 @@
 # along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
-import codecs
+import os
+import time
+import json
 import sqlite3
 
+# Bump when the tables or views created by ck2_db change. Databases
+# stamped with the current version skip the schema creation.
+SCHEMA_VERSION = 3
+
+# RE patterns, compiled once and shared by every parser
+key_key_value_pattern = '^\s*([^\s]+)\s*=\s*{\s*([^\s]+)\s*=\s*"?([^{}"\s][^{}"]*)"?\s*}'
+key_value_pattern = '^\s*([^\s]+)\s*=\s*(?:{\s*)?"?([^{}"\s][^{}"]*)"?(?:\s*{)?'
+key_no_value_pattern = "^\s*([^\s]+)\s*=\s*{?"
+single_line_bracket = "^\s*([^{}\s=][^{}=]+)\s*}" #added =
+all_numeric_pattern = "^\d+$"
+date_pattern = "^\-?\d{1,4}\.\d{1,2}\.\d{1,2}$"
+title_pattern = "^(([bcdke])_[^\s=]+)"
+rel_pattern = "^rel_(\d+)$"
+comment_pattern = "\#.*$"
+clean_date_pattern = "^(\d{1,4})[^\d](\d{1,2})[^\d](\d{1,2})$"
+
+kkvp = re.compile(key_key_value_pattern)
+kvp = re.compile(key_value_pattern)
+knvp = re.compile(key_no_value_pattern)
+slb = re.compile(single_line_bracket)
+anp = re.compile(all_numeric_pattern)
+dtp = re.compile(date_pattern)
+tip = re.compile(title_pattern)
+rep = re.compile(rel_pattern)
+cp = re.compile(comment_pattern)
+cdp = re.compile(clean_date_pattern)
+
+# Low cardinality strings. With encode_strings, these columns hold
+# ids of a <domain>_lookup table. The data goes to <table>_data, and
+# a view named as the table gives back the text columns.
+encoded_fields = {}
+encoded_fields['historic_dynasty'] = {'culture' : 'culture'}
+encoded_fields['dynasty'] = {'culture' : 'culture'}
+encoded_fields['landed_title'] = {'title_id' : 'title', 'de_jure_liege' : 'title', 'culture' : 'culture', 'religion' : 'religion'}
+encoded_fields['historic_character'] = {'culture' : 'culture', 'religion' : 'religion'}
+encoded_fields['character'] = {'culture' : 'culture', 'religion' : 'religion', 'graphical_culture' : 'graphical_culture'}
+encoded_fields['province'] = {'culture' : 'culture', 'religion' : 'religion', 'title_id' : 'title'}
+encoded_fields['claim'] = {'title_id' : 'title'}
+encoded_fields['title'] = {'id' : 'title', 'liege' : 'title', 'succession' : 'succession', 'gender' : 'gender'}
 
 def clean_date(original_date) :
     if not original_date :
         return None
     
-    date_pattern = "^(\d{1,4})[^\d](\d{1,2})[^\d](\d{1,2})$"
-    dp = re.compile(date_pattern)
-    dp_match = dp.match(original_date)
+    dp_match = cdp.match(original_date)
     
     if dp_match :
         return "%s-%s-%s" % (dp_match.group(1).zfill(4),dp_match.group(2).zfill(2),dp_match.group(3).zfill(2))
     else :
         return None
 
+def file_signature(path) :
+    # Size and modification time, to tell whether a file changed
+    try :
+        st = os.stat(path)
+    except OSError :
+        return None
+    return (st.st_size, st.st_mtime)
+
 class ck2_parser :
-    def __init__(self, dbconn, drop_tables = False) :
-        
-        # RE patterns
-        key_key_value_pattern = '^\s*([^\s]+)\s*=\s*{\s*([^\s]+)\s*=\s*"?([^{}"\s][^{}"]*)"?\s*}'
-        key_value_pattern = '^\s*([^\s]+)\s*=\s*(?:{\s*)?"?([^{}"\s][^{}"]*)"?(?:\s*{)?'
-        key_no_value_pattern = "^\s*([^\s]+)\s*=\s*{?"
-        single_line_bracket = "^\s*([^{}\s=][^{}=]+)\s*}" #added =
-        all_numeric_pattern = "^\d+$"
-        date_pattern = "^\-?\d{1,4}\.\d{1,2}\.\d{1,2}$"
-        title_pattern = "^(([bcdke])_[^\s=]+)"
-        rel_pattern = "^rel_(\d+)$"
-        comment_pattern = "\#.*$"
-        
-        # Compiled RE patterns
-        self.kkvp = re.compile(key_key_value_pattern)
-        self.kvp = re.compile(key_value_pattern)
-        self.knvp = re.compile(key_no_value_pattern)
-        self.slb = re.compile(single_line_bracket)
-        self.anp = re.compile(all_numeric_pattern)
-        self.dtp = re.compile(date_pattern)
-        self.tip = re.compile(title_pattern)
-        self.rep = re.compile(rel_pattern)
-        self.cp = re.compile(comment_pattern)
+    """
+        ck2_parser reads CK2 saved games and loads them into dbconn.
+        
+        With checkpoint_elements or checkpoint_seconds set, rows are only
+        committed together with a checkpoint of the parse position, so an
+        interrupted load can be resumed with parse_file(path, resume = True)
+        without duplicate rows. A finished load keeps a completed checkpoint,
+        so resuming it again skips the file until it changes.
+        
+        Every row records the file it was read from. Loading a file again
+        replaces the rows of its earlier load. Without checkpoints nothing
+        is committed until the load ends, so readers see the earlier rows
+        until then. With checkpoints, or with shards, which are committed
+        one file at a time, the replacement isn't atomic: readers can see a
+        partial load until it ends.
+        
+        dbconn : sqlite3 connection of the output database, or None to only
+            parse (subclasses override save_element_to_db)
+        drop_tables : drop and recreate the tables before loading
+        checkpoint_elements : save a checkpoint every n closed elements
+        checkpoint_seconds : save a checkpoint every n seconds
+        encode_strings : store low cardinality strings as lookup table ids
+        shards : dict of table name -> sqlite3 connection of its shard, see ck2_shards
+    """
+    def __init__(self, dbconn, drop_tables = False, checkpoint_elements = 0, checkpoint_seconds = 0, encode_strings = False, shards = None) :
+        
+        # Compiled RE patterns, shared at module level
+        self.kkvp = kkvp
+        self.kvp = kvp
+        self.knvp = knvp
+        self.slb = slb
+        self.anp = anp
+        self.dtp = dtp
+        self.tip = tip
+        self.rep = rep
+        self.cp = cp
         
         # The stack keeps track of the depth.
         self.tag_stack = []
@@ -73,8 +133,21 @@ class ck2_parser :
         # once the tag is opened, clear tag name to deal properly with brackets
         self.tagname = ""
         self.line_count = 0
-        
-        self.db = ck2_db(dbconn, 10000, drop_tables)
+        self.element_count = 0
+        
+        self.checkpoint_elements = checkpoint_elements
+        self.checkpoint_seconds = checkpoint_seconds
+        
+        if dbconn is not None :
+            if shards and (checkpoint_elements or checkpoint_seconds) :
+                # A checkpoint can't be committed atomically across several files
+                raise Exception("Checkpoints can't be used with shards")
+            self.db = ck2_db(dbconn, 10000, drop_tables, encode_strings, shards)
+            # Rows are committed with the checkpoints only
+            self.db.deferred_commit = bool(checkpoint_elements or checkpoint_seconds)
+        else :
+            # No database. Subclasses override save_element_to_db
+            self.db = None
         
         self.root = ""
     
@@ -276,6 +349,7 @@ class ck2_parser :
         #print "end_element before full dict = %s " % repr(self.dict)
         
         self.save_element_to_db()
+        self.element_count += 1
         
         top = self.tag_stack.pop()
         
@@ -383,26 +457,98 @@ class ck2_parser :
             # print "No method to handle tag %s %s" % (self.get_tag_path(), tag)
             pass
             
-    def parse_file(self, path, root="CK2_Save_game") :
+    def get_state(self) :
+        # Everything needed to continue parsing from a line boundary
+        return {
+            'root' : self.root,
+            'tag_stack' : self.tag_stack,
+            'dict' : self.dict,
+            'tagname' : self.tagname,
+            'line_count' : self.line_count,
+            'element_count' : self.element_count,
+        }
+    
+    def set_state(self, state) :
+        self.root = state['root']
+        self.tag_stack = state['tag_stack']
+        self.dict = state['dict']
+        self.tagname = state['tagname']
+        self.line_count = state['line_count']
+        self.element_count = state['element_count']
+    
+    def save_checkpoint(self, path, offset) :
+        self.db.save_checkpoint(path, offset, self.line_count, json.dumps(self.get_state()))
+        print "[%i] checkpoint at byte %i, %i records" % (self.line_count, offset, self.db.insert_count)
+    
+    def start_file(self, root) :
         # clear the stack and the dict
         self.root = root
         self.tag_stack = []
         self.dict = []
         self.line_count = 0
+        self.element_count = 0
         # Add a root element
         self.add_level(root)
+    
+    def read_lines(self, path, offset = 0) :
+        """
+            Feeds the lines of path from byte offset to process_line, and
+            yields the offset reached after each line.
+        """
+        # Read bytes to keep track of the offset. cp1252 is a single byte
+        # encoding, so every line can be decoded on its own.
+        with open(path, 'rb') as f :
+            f.seek(offset)
+            for raw_line in f :
+                offset += len(raw_line)
+                self.process_line(raw_line.decode('cp1252'))
+                yield offset
+    
+    def parse_file(self, path, root="CK2_Save_game", resume = False) :
+        path = os.path.abspath(path)
+        if self.db is None :
+            # Nothing to checkpoint or close, save_element_to_db gets the elements
+            self.start_file(root)
+            for offset in self.read_lines(path) :
+                pass
+            return
         
-        with codecs.open(path,'r','cp1252') as f :
-            #os.remove('testfile.txt')
-            for line in f :
-                self.process_line(line)
-                #try :
-                #    self.process_line(line)
-                #except Exception as error:
-                #    self.db.close()
-                #    raise error
-                if self.line_count > 10000000 :
-                    break
+        offset = 0
+        checkpoint = None
+        if resume :
+            checkpoint = self.db.load_checkpoint(path)
+        if checkpoint :
+            offset, row_count, state, completed = checkpoint
+            if completed :
+                print "%s is already loaded, skipping it" % (path)
+                return
+            self.set_state(json.loads(state))
+            self.db.insert_count = row_count
+            self.db.resume_source(path)
+            print "[%i] resuming %s from byte %i" % (self.line_count, path, offset)
+        else :
+            self.db.begin_source(path)
+            self.start_file(root)
+        
+        checkpoint_mode = self.db.deferred_commit
+        last_elements = self.element_count
+        last_time = time.time()
+        
+        for offset in self.read_lines(path, offset) :
+            if checkpoint_mode :
+                if self.checkpoint_elements and self.element_count - last_elements >= self.checkpoint_elements :
+                    due = True
+                elif self.checkpoint_seconds and time.time() - last_time >= self.checkpoint_seconds :
+                    due = True
+                else :
+                    due = False
+                if due :
+                    self.save_checkpoint(path, offset)
+                    last_elements = self.element_count
+                    last_time = time.time()
+        
+        # Resuming a finished file would load its rows again
+        self.db.save_checkpoint(path, offset, self.line_count, None, True)
         self.db.close()
 
 def rename_dict_key(dict, old_key, new_key) :
@@ -441,9 +587,14 @@ def generate_value_tuple(dict, key_list) :
     return tuple(map(lambda x: dict.get(x),key_list))
                 
 class ck2_db :
-    def __init__ (self, dbconn, commit_interval = 1000, drop_tables = False) :
+    def __init__ (self, dbconn, commit_interval = 1000, drop_tables = False, encode_strings = False, shards = None) :
         self.conn = dbconn
         self.c = self.conn.cursor()
+        self.encode_strings = encode_strings
+        # Tables written to their own shard database. The main database
+        # keeps an empty copy of them, so its views can be created.
+        self.shards = shards or {}
+        self.shard_cursors = dict((table_name, conn.cursor()) for table_name, conn in self.shards.items())
         self.fields = {}
         self.fields['historic_dynasty'] = ['id', 'name', 'culture']
         self.fields['dynasty'] = ['id', 'name', 'culture']
@@ -493,34 +644,175 @@ class ck2_db :
         
         self.fields['title'] = ['id', 'liege', 'holder', 'succession', 'gender', 'usurp_date', 'army_size_percentage', 'set_investiture', 'active', 'de_jure_law_changer', 'normal_law_changer', 'succ_law_changer', 'de_jure_law_change', 'normal_law_change', 'succ_law_change', 'set_the_kings_peace', 'set_protected_inheritance', 'set_appoint_generals', 'set_allow_title_revokation', 'set_allow_free_infidel_revokation', 'cannot_cancel_vote', 'previous']
         
+        self.encoded_fields = encoded_fields
+        
         self.db_init(drop_tables)
+        
+        # id in source_file of the file being loaded, stored in every row
+        self.source_id = None
+        
+        # In memory string -> id dictionary of every lookup domain
+        self.lookups = {}
+        if self.encode_strings :
+            for domain in self.get_lookup_domains() :
+                self.lookups[domain] = dict((name, id) for id, name in self.c.execute("SELECT id, name FROM %s_lookup" % (domain)))
+        
         self.insert_count = 0
         self.commit_interval = max(1,commit_interval)
+        # When set, rows are only committed by save_checkpoint and close
+        self.deferred_commit = False
+        # Set while the rows of an earlier load are replaced, which are
+        # only committed by close unless checkpoints are saved
+        self.replacing = False
+    
+    def get_lookup_domains(self) :
+        domains = set()
+        for encoded in self.encoded_fields.values() :
+            domains.update(encoded.values())
+        return sorted(domains)
+    
+    def get_lookup_id(self, domain, name) :
+        lookup = self.lookups[domain]
+        id = lookup.get(name)
+        if id is None :
+            # Let SQLite pick the id: another process loading into the same
+            # database may have added names since the dictionary was read
+            self.c.execute("INSERT OR IGNORE INTO %s_lookup (name) VALUES (?)" % (domain), (name,))
+            self.c.execute("SELECT id FROM %s_lookup WHERE name = ?" % (domain), (name,))
+            id = self.c.fetchone()[0]
+            lookup[name] = id
+        return id
+    
+    def get_cursor(self, table_name) :
+        return self.shard_cursors.get(table_name, self.c)
+    
+    def get_physical_table(self, table_name) :
+        if self.encode_strings and table_name in self.encoded_fields :
+            return table_name + "_data"
+        return table_name
+    
+    def get_physical_columns(self, table_name) :
+        encoded = {}
+        if self.encode_strings :
+            encoded = self.encoded_fields.get(table_name, {})
+        columns = [field + " INTEGER" if field in encoded else field for field in self.fields[table_name]]
+        return ", ".join(columns + ["source_id INTEGER"])
+    
+    def commit(self) :
+        self.conn.commit()
+        for conn in set(self.shards.values()) :
+            conn.commit()
+    
+    def holds_commits(self) :
+        return self.deferred_commit or self.replacing
     
     def insert_record(self, table_name, dict) :
         fields = self.fields[table_name]
         validate_dict(dict, table_name, fields)
+        dict['source_id'] = self.source_id
+        fields = fields + ['source_id']
+        cursor = self.get_cursor(table_name)
+        if self.encode_strings and table_name in self.encoded_fields :
+            for field, domain in self.encoded_fields[table_name].items() :
+                if dict.get(field) is not None :
+                    dict[field] = self.get_lookup_id(domain, dict[field])
+            table_name = table_name + "_data"
         sql = generate_insert_sql(table_name, fields)
         values = generate_value_tuple(dict, fields)
         
         #print (sql, repr(values))
         try :
-            self.c.execute(sql, values)
+            cursor.execute(sql, values)
         except Exception:
-            self.conn.commit()
+            if not self.holds_commits() :
+                self.commit()
             print ">%s -- %s<" % (sql,repr(values))
             raise Exception
         self.insert_count = self.insert_count + 1
-        if self.insert_count % self.commit_interval == 0 :
+        if self.insert_count % self.commit_interval == 0 and not self.holds_commits() :
             print "Inserted %i records" % (self.insert_count)
-            self.conn.commit()
+            self.commit()
 
+    def get_object_type(self, name) :
+        self.c.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,))
+        row = self.c.fetchone()
+        if row :
+            return row[0]
+        return None
+    
+    def drop_object(self, name) :
+        object_type = self.get_object_type(name)
+        if object_type in ['table', 'view'] :
+            self.c.execute("DROP %s %s" % (object_type.upper(), name))
+    
+    def create_encoded_table(self, table_name) :
+        fields = self.fields[table_name]
+        encoded = self.encoded_fields[table_name]
+        if self.get_object_type(table_name) == 'table' :
+            raise Exception("Table %s holds text columns. Drop the tables to load with encoded strings" % (table_name))
+        
+        self.c.execute("CREATE TABLE IF NOT EXISTS %s_data (%s)" % (table_name, self.get_physical_columns(table_name)))
+        
+        select = []
+        joins = []
+        for field in fields :
+            if field in encoded :
+                select.append("l_%s.name %s" % (field, field))
+                joins.append("LEFT JOIN %s_lookup l_%s ON l_%s.id = d.%s" % (encoded[field], field, field, field))
+            else :
+                select.append("d.%s" % (field))
+        self.c.execute("CREATE VIEW IF NOT EXISTS %s AS SELECT %s FROM %s_data d %s" % (table_name, ", ".join(select), table_name, " ".join(joins)))
+    
+    def get_schema_version(self) :
+        # Encoded databases have a different schema, keep their versions apart
+        return SCHEMA_VERSION * 2 + (1 if self.encode_strings else 0)
+    
+    def is_schema_current(self) :
+        version = self.get_schema_version()
+        for conn in [self.conn] + list(set(self.shards.values())) :
+            if conn.execute("PRAGMA user_version").fetchone()[0] != version :
+                return False
+        return True
+    
     def db_init(self, drop_tables = False) :
+        if not drop_tables and self.is_schema_current() :
+            return
+        if drop_tables :
+            for domain in self.get_lookup_domains() :
+                self.drop_object(domain + "_lookup")
+        if self.encode_strings :
+            for domain in self.get_lookup_domains() :
+                self.c.execute("CREATE TABLE IF NOT EXISTS %s_lookup (id INTEGER PRIMARY KEY, name TEXT UNIQUE)" % (domain))
         for table_name in self.fields.keys() :
             if drop_tables :
-                self.c.execute("DROP TABLE IF EXISTS %s" % (table_name))
-            columns = ", ".join(self.fields[table_name])
-            self.c.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (table_name, columns))
+                self.drop_object(table_name)
+                self.drop_object(table_name + "_data")
+            if self.encode_strings and table_name in self.encoded_fields :
+                self.create_encoded_table(table_name)
+            else :
+                if self.get_object_type(table_name) == 'view' :
+                    raise Exception("Table %s holds encoded strings. Load with encoded strings or drop the tables" % (table_name))
+                self.c.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (table_name, self.get_physical_columns(table_name)))
+            # Added in schema version 3
+            self.add_missing_columns(self.c, self.get_physical_table(table_name), ['source_id'])
+        for table_name, cursor in self.shard_cursors.items() :
+            physical_table = self.get_physical_table(table_name)
+            if drop_tables :
+                cursor.execute("DROP TABLE IF EXISTS %s" % (physical_table))
+            cursor.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (physical_table, self.get_physical_columns(table_name)))
+            self.add_missing_columns(cursor, physical_table, ['source_id'])
+        if drop_tables :
+            self.c.execute("DROP TABLE IF EXISTS parse_checkpoint")
+        # One row per loaded file. AUTOINCREMENT keeps the ids of replaced
+        # loads from being reused.
+        self.c.execute("CREATE TABLE IF NOT EXISTS source_file (id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT UNIQUE, loaded_at)")
+        if drop_tables :
+            # Emptied rather than dropped, which would reset AUTOINCREMENT:
+            # rows left in shard files keep the ids of the dropped loads
+            self.c.execute("DELETE FROM source_file")
+        self.c.execute("CREATE TABLE IF NOT EXISTS parse_checkpoint (path, byte_offset, line_count, row_count, state, saved_at)")
+        # Added in schema version 2
+        self.add_missing_columns(self.c, "parse_checkpoint", ['file_size', 'file_mtime', 'completed'])
         views = [
             "CREATE VIEW IF NOT EXISTS dynasty_view AS SELECT id, name, culture from historic_dynasty UNION SELECT id, name, culture from dynasty",
             """CREATE VIEW IF NOT EXISTS character_view AS SELECT tmp.id, coalesce(ch.birth_name,hc.name) name, coalesce(ch.female,hc.female) female,         
@@ -570,8 +862,17 @@ class ck2_db :
         ]
         for query in views :
             self.c.execute(query)
-        self.conn.commit()
-        
+        for conn in [self.conn] + list(set(self.shards.values())) :
+            conn.execute("PRAGMA user_version = %i" % (self.get_schema_version()))
+        self.commit()
+        
+    def add_missing_columns(self, cursor, table_name, columns) :
+        # CREATE TABLE IF NOT EXISTS keeps the columns of older schema versions
+        existing = [row[1] for row in cursor.execute("PRAGMA table_info(%s)" % (table_name)).fetchall()]
+        for column in columns :
+            if column not in existing :
+                cursor.execute("ALTER TABLE %s ADD COLUMN %s" % (table_name, column))
+    
     def db_get_column_names(self, table_name) :
         pass
         # validate table_name
@@ -669,6 +970,52 @@ class ck2_db :
         fdict['succ_law_change'] = clean_date(fdict.get('succ_law_change'))
         
         self.insert_record('title',fdict)
+    def begin_source(self, path) :
+        # Rows of an earlier load of path are deleted in the transaction
+        # that inserts the rows of this one, see replacing
+        self.c.execute("SELECT id FROM source_file WHERE path = ?", (path,))
+        row = self.c.fetchone()
+        self.replacing = row is not None
+        if row :
+            for table_name in self.fields.keys() :
+                physical_table = self.get_physical_table(table_name)
+                self.c.execute("DELETE FROM %s WHERE source_id = ?" % (physical_table), row)
+                if table_name in self.shard_cursors :
+                    self.shard_cursors[table_name].execute("DELETE FROM %s WHERE source_id = ?" % (physical_table), row)
+            self.c.execute("DELETE FROM source_file WHERE id = ?", row)
+        self.c.execute("INSERT INTO source_file (path, loaded_at) VALUES (?, datetime('now'))", (path,))
+        self.source_id = self.c.lastrowid
+    
+    def resume_source(self, path) :
+        self.c.execute("SELECT id FROM source_file WHERE path = ?", (path,))
+        row = self.c.fetchone()
+        if row is None :
+            # Checkpoint saved before the files were recorded
+            self.begin_source(path)
+        else :
+            self.source_id = row[0]
+    
+    def save_checkpoint(self, path, offset, line_count, state, completed = False) :
+        # Saved in the same transaction as the rows inserted since the last
+        # checkpoint, so both are committed or lost together. The file
+        # signature tells whether the offset still applies to the file.
+        file_size, file_mtime = file_signature(path)
+        self.c.execute("DELETE FROM parse_checkpoint WHERE path = ?", (path,))
+        self.c.execute("""INSERT INTO parse_checkpoint (path, byte_offset, line_count, row_count, state, saved_at, file_size, file_mtime, completed)
+            VALUES (?, ?, ?, ?, ?, datetime('now'), ?, ?, ?)""",
+            (path, offset, line_count, self.insert_count, state, file_size, file_mtime, 1 if completed else 0))
+        self.commit()
+        
+    def load_checkpoint(self, path) :
+        # Returns (byte_offset, row_count, state, completed), or None when
+        # there is no checkpoint or the file changed since it was saved
+        self.c.execute("SELECT byte_offset, row_count, state, completed, file_size, file_mtime FROM parse_checkpoint WHERE path = ?", (path,))
+        row = self.c.fetchone()
+        if row is None or (row[4], row[5]) != file_signature(path) :
+            return None
+        return row[0], row[1], row[2], bool(row[3])
+        
     def close(self) :
-        self.conn.commit()
+        self.commit()
+        self.replacing = False
         
\ No newline at end of file
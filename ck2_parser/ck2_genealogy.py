@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+# ck2_genealogy answers ancestry and descent questions over a loaded CK2 database.
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+from .ck2_cache import lru_cache
+
+
+def table_exists(conn, table_name) :
+    cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type IN ('table','view') AND name = ?", (table_name,))
+    return cursor.fetchone() is not None
+
+def build_closure_table(conn, table_name, edge_query, max_depth = 64, key_type = "INTEGER") :
+    """
+        build_closure_table materializes the transitive closure of a
+        child -> parent relation as (ancestor, descendant, depth, paths)
+        rows, where paths is the number of distinct chains of that depth
+        from the descendant up to the ancestor.
+
+        conn : sqlite3 connection holding the source tables
+        table_name : name of the closure table, replaced if it exists
+        edge_query : SELECT returning (child, parent) pairs
+        max_depth : longest chain followed. Also stops cycles in bad data
+        key_type : column type for ancestor and descendant
+    """
+    c = conn.cursor()
+    # Copy the edges once, so every level joins an indexed table
+    # instead of re-evaluating the source views.
+    c.execute("DROP TABLE IF EXISTS temp.closure_edge")
+    c.execute("CREATE TEMP TABLE closure_edge (child %s, parent %s)" % (key_type, key_type))
+    c.execute("INSERT INTO closure_edge (child, parent) SELECT * FROM (%s)" % (edge_query))
+    c.execute("CREATE INDEX temp.closure_edge_child ON closure_edge (child)")
+
+    c.execute("DROP TABLE IF EXISTS %s" % (table_name))
+    c.execute("CREATE TABLE %s (ancestor %s, descendant %s, depth INTEGER, paths INTEGER)" % (table_name, key_type, key_type))
+
+    # One level at a time: the chains of depth + 1 extend the chains of
+    # depth by one edge. Summing the path counts per (ancestor, descendant)
+    # keeps pedigree collapse (the same ancestor reached through several
+    # lines) without enumerating every chain, which grows exponentially.
+    c.execute("DROP TABLE IF EXISTS temp.closure_level")
+    c.execute("""CREATE TEMP TABLE closure_level AS
+        SELECT parent ancestor, child descendant, count(*) paths FROM closure_edge GROUP BY parent, child""")
+    depth = 1
+    while True :
+        c.execute("""INSERT INTO %s (ancestor, descendant, depth, paths)
+            SELECT ancestor, descendant, ?, paths FROM closure_level""" % (table_name), (depth,))
+        if c.rowcount <= 0 or depth >= max_depth :
+            break
+        c.execute("DROP TABLE IF EXISTS temp.closure_next")
+        c.execute("""CREATE TEMP TABLE closure_next AS
+            SELECT e.parent ancestor, l.descendant descendant, sum(l.paths) paths
+            FROM closure_level l JOIN closure_edge e ON e.child = l.ancestor
+            GROUP BY e.parent, l.descendant""")
+        c.execute("DROP TABLE temp.closure_level")
+        c.execute("ALTER TABLE temp.closure_next RENAME TO closure_level")
+        depth += 1
+
+    # Indexes are created after the load, it is cheaper than keeping them up to date
+    c.execute("CREATE INDEX %s_descendant ON %s (descendant, depth)" % (table_name, table_name))
+    c.execute("CREATE INDEX %s_ancestor ON %s (ancestor, depth)" % (table_name, table_name))
+    c.execute("DROP TABLE temp.closure_edge")
+    c.execute("DROP TABLE temp.closure_level")
+    conn.commit()
+
+    count = conn.execute("SELECT count(*) FROM %s" % (table_name)).fetchone()[0]
+    print "Built %s with %i rows" % (table_name, count)
+    return count
+
+class ck2_genealogy :
+    """
+        ck2_genealogy answers ancestor and descendant queries from the
+        ancestry_closure table, built once after a save is loaded.
+
+        dbconn : sqlite3 connection to a database loaded by ck2_parser
+        cache_size : number of lookups kept in memory
+    """
+    closure_table = "ancestry_closure"
+    edge_query = """SELECT id, father FROM character_view WHERE father IS NOT NULL
+        UNION SELECT id, mother FROM character_view WHERE mother IS NOT NULL"""
+
+    def __init__(self, dbconn, cache_size = 10000) :
+        self.conn = dbconn
+        self.cache = lru_cache(cache_size)
+
+    def build(self, rebuild = True, max_depth = 64) :
+        if rebuild or not table_exists(self.conn, self.closure_table) :
+            build_closure_table(self.conn, self.closure_table, self.edge_query, max_depth)
+        self.cache.clear()
+
+    def get_ancestors(self, character_id, max_depth = None) :
+        """
+            Returns a list of (ancestor id, depth, paths) tuples. Parents are
+            depth 1, paths counts the lines of that depth to the ancestor.
+        """
+        character_id = int(character_id)
+        sql = "SELECT ancestor, depth, paths FROM %s WHERE descendant = ?" % (self.closure_table)
+        params = (character_id,)
+        if max_depth :
+            sql += " AND depth <= ?"
+            params += (max_depth,)
+        sql += " ORDER BY depth, ancestor"
+        return self.cache.fetchall(self.conn, ('ancestors', character_id, max_depth), sql, params)
+
+    def get_descendants(self, character_id, max_depth = None) :
+        """
+            Returns a list of (descendant id, depth, paths) tuples. Children
+            are depth 1.
+        """
+        character_id = int(character_id)
+        sql = "SELECT descendant, depth, paths FROM %s WHERE ancestor = ?" % (self.closure_table)
+        params = (character_id,)
+        if max_depth :
+            sql += " AND depth <= ?"
+            params += (max_depth,)
+        sql += " ORDER BY depth, descendant"
+        return self.cache.fetchall(self.conn, ('descendants', character_id, max_depth), sql, params)
+
+    def get_ancestor_paths(self, character_id, max_depth = None) :
+        # The character itself is included at depth 0, so direct lines
+        # (parent and child, grandparent and grandchild) share an ancestor
+        paths = {int(character_id) : [(0, 1)]}
+        for ancestor, depth, count in self.get_ancestors(character_id, max_depth) :
+            paths.setdefault(ancestor, []).append((depth, count))
+        return paths
+
+    def get_ancestor_depths(self, character_id, max_depth = None) :
+        return dict((ancestor, [depth for depth, count in lines])
+            for ancestor, lines in self.get_ancestor_paths(character_id, max_depth).items())
+
+    def is_ancestor(self, ancestor_id, character_id) :
+        ancestor_id = int(ancestor_id)
+        return any(row[0] == ancestor_id for row in self.get_ancestors(character_id))
+
+    def get_common_ancestors(self, character1, character2, max_depth = None) :
+        """
+            Returns a list of (ancestor id, depth from character1, depth from
+            character2) tuples, using the shortest depth on each side.
+        """
+        depths1 = self.get_ancestor_depths(character1, max_depth)
+        depths2 = self.get_ancestor_depths(character2, max_depth)
+        common = set(depths1.keys()) & set(depths2.keys())
+        return sorted([(ancestor, min(depths1[ancestor]), min(depths2[ancestor])) for ancestor in common],
+            key = lambda x: (x[1] + x[2], x[0]))
+
+    def get_relationship_coefficient(self, character1, character2, max_depth = None) :
+        """
+            Returns the coefficient of relationship between two characters:
+            the sum of 1/2 ** (depth1 + depth2) over every pair of lines that
+            go up from each character and first meet at a common ancestor.
+            Full siblings are 0.5, first cousins 0.125, and pedigree collapse
+            adds up, so the child of two siblings is 0.75 to either parent.
+        """
+        paths1 = self.get_ancestor_paths(character1, max_depth)
+        paths2 = self.get_ancestor_paths(character2, max_depth)
+        common = set(paths1.keys()) & set(paths2.keys())
+
+        def weight(lines) :
+            return sum(count * 0.5 ** depth for depth, count in lines)
+
+        # links[a] holds (b, weight of the lines from b up to a) for every
+        # common ancestor b below a
+        links = dict((ancestor, []) for ancestor in common)
+        for below in common :
+            lines = {}
+            for ancestor, depth, count in self.get_ancestors(below, max_depth) :
+                if ancestor in common :
+                    lines.setdefault(ancestor, []).append((depth, count))
+            for ancestor, ancestor_lines in lines.items() :
+                links[ancestor].append((below, weight(ancestor_lines)))
+
+        # Pairs of lines meeting at an ancestor either meet there first, or
+        # first meet at a common ancestor below it and go on to it by any two
+        # lines. Subtracting the latter, nearest ancestors first, leaves the
+        # pairs that first meet at each ancestor.
+        first_meet = {}
+        for ancestor in sorted(common, key = lambda x: len(links[x])) :
+            value = weight(paths1[ancestor]) * weight(paths2[ancestor])
+            for below, link in links[ancestor] :
+                value -= first_meet[below] * link ** 2
+            first_meet[ancestor] = value
+        return sum(first_meet.values())
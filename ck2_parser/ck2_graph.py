@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+# ck2_graph keeps the character relations of a CK2 saved game in NumPy arrays.
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+
+def parse_id(value) :
+    # Multi valued fields (several spouses) are stored space separated.
+    # The graph keeps the first one.
+    if value is None :
+        return -1
+    try :
+        return int(str(value).split()[0])
+    except (ValueError, IndexError) :
+        return -1
+
+def parse_date(value) :
+    # Dates are stored as YYYY-MM-DD by clean_date. Keep them as YYYYMMDD
+    # integers so they sort and compare as numbers.
+    if not value :
+        return -1
+    try :
+        return int(str(value).replace("-", ""))
+    except ValueError :
+        return -1
+
+def csr_from_edges(sources, targets, size) :
+    """
+        csr_from_edges builds a compressed sparse row adjacency from two
+        parallel arrays of node indexes. Returns (indptr, indices), the
+        targets of node i are indices[indptr[i]:indptr[i + 1]].
+    """
+    order = np.argsort(sources, kind = 'mergesort')
+    indices = targets[order].astype(np.int32)
+    counts = np.bincount(sources, minlength = size)
+    indptr = np.zeros(size + 1, dtype = np.int64)
+    np.cumsum(counts, out = indptr[1:])
+    return indptr, indices
+
+def csr_expand(indptr, indices, nodes) :
+    # Concatenated targets of every node in nodes, without a Python loop
+    starts = indptr[nodes]
+    lengths = indptr[nodes + 1] - starts
+    total = lengths.sum()
+    if total == 0 :
+        return np.zeros(0, dtype = np.int32)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return indices[offsets + np.arange(total)]
+
+class ck2_graph :
+    """
+        ck2_graph loads the character relations once into integer arrays
+        indexed by position, and answers traversals and filters with
+        vectorized operations instead of SQL round trips.
+
+        Missing relations are stored as -1. Children are kept as a CSR
+        adjacency built from the father and mother arrays.
+
+        rows : iterable of tuples ordered as ck2_graph.columns
+    """
+    columns = ['id', 'father', 'mother', 'spouse', 'betrothal', 'dynasty', 'host', 'employer',
+        'female', 'birth_date', 'death_date', 'player']
+
+    def __init__(self, rows) :
+        rows = list(rows)
+        size = len(rows)
+        fields = zip(*rows) if rows else [[]] * len(self.columns)
+        raw = dict(zip(self.columns, fields))
+
+        ids = np.array([parse_id(x) for x in raw['id']], dtype = np.int64)
+        order = np.argsort(ids)
+        self.ids = ids[order]
+        self.size = size
+
+        def column(name, parse, dtype) :
+            return np.array([parse(x) for x in raw[name]], dtype = dtype)[order]
+
+        self.dynasty = column('dynasty', parse_id, np.int64)
+        self.birth = column('birth_date', parse_date, np.int32)
+        self.alive = column('death_date', lambda x: not x, np.bool_)
+        self.female = column('female', lambda x: x == 'yes', np.bool_)
+        self.player = column('player', lambda x: x == 'yes', np.bool_)
+        self.betrothed = column('betrothal', lambda x: x is not None, np.bool_)
+
+        self.father = self.index_of(column('father', parse_id, np.int64))
+        self.mother = self.index_of(column('mother', parse_id, np.int64))
+        self.spouse = self.index_of(column('spouse', parse_id, np.int64))
+        self.host = self.index_of(column('host', parse_id, np.int64))
+        self.employer = self.index_of(column('employer', parse_id, np.int64))
+
+        positions = np.arange(size, dtype = np.int32)
+        parents = np.concatenate([self.father, self.mother])
+        children = np.concatenate([positions, positions])
+        known = parents >= 0
+        self.children_ptr, self.children_idx = csr_from_edges(parents[known], children[known], size)
+
+        self.ancestor_matrices = {}
+
+    @classmethod
+    def from_db(cls, dbconn, table_name = 'character') :
+        sql = "SELECT %s FROM %s" % (", ".join(cls.columns), table_name)
+        return cls(dbconn.execute(sql).fetchall())
+
+    # Id <-> position translation
+    def index_of(self, character_ids) :
+        """ Positions of character_ids in the graph, -1 for unknown ids. """
+        character_ids = np.atleast_1d(np.asarray(character_ids, dtype = np.int64))
+        if self.size == 0 :
+            return np.full(character_ids.shape, -1, dtype = np.int32)
+        positions = np.searchsorted(self.ids, character_ids)
+        positions = np.minimum(positions, self.size - 1)
+        found = self.ids[positions] == character_ids
+        return np.where(found, positions, -1).astype(np.int32)
+
+    def to_ids(self, positions) :
+        return self.ids[positions[positions >= 0]]
+
+    # Traversals
+    def parents_of(self, positions) :
+        found = np.concatenate([self.father[positions], self.mother[positions]])
+        return found[found >= 0]
+
+    def children_of(self, positions) :
+        return csr_expand(self.children_ptr, self.children_idx, positions)
+
+    def walk(self, character_ids, step, max_depth = None) :
+        visited = np.zeros(self.size, dtype = np.bool_)
+        frontier = self.index_of(character_ids)
+        frontier = frontier[frontier >= 0]
+        depth = 0
+        while len(frontier) and (max_depth is None or depth < max_depth) :
+            frontier = np.unique(step(frontier))
+            frontier = frontier[~visited[frontier]]
+            visited[frontier] = True
+            depth += 1
+        return visited
+
+    def ancestors(self, character_ids, max_depth = None) :
+        """ Ids of every ancestor of character_ids. """
+        return self.ids[self.walk(character_ids, self.parents_of, max_depth)]
+
+    def descendants(self, character_ids, max_depth = None) :
+        """ Ids of every descendant of character_ids. """
+        return self.ids[self.walk(character_ids, self.children_of, max_depth)]
+
+    # Filters
+    def living_dynasts(self, dynasty_ids = None) :
+        """
+            Ids of living members of dynasty_ids. Defaults to the player
+            dynasties, like the live_dynasts view.
+        """
+        if dynasty_ids is None :
+            dynasty_ids = self.dynasty[self.player]
+        mask = self.alive & np.in1d(self.dynasty, np.atleast_1d(dynasty_ids)) & (self.dynasty >= 0)
+        return self.ids[mask]
+
+    def single_dynasts(self, dynasty_ids = None) :
+        """ Living, unmarried and not betrothed dynasts, like the single_dynasts view. """
+        if dynasty_ids is None :
+            dynasty_ids = self.dynasty[self.player]
+        mask = self.alive & (self.spouse < 0) & ~self.betrothed
+        mask &= np.in1d(self.dynasty, np.atleast_1d(dynasty_ids)) & (self.dynasty >= 0)
+        return self.ids[mask]
+
+    def court(self, host_id) :
+        """ Ids of the living characters hosted by host_id. """
+        host = self.index_of(host_id)[0]
+        if host < 0 :
+            return self.ids[:0]
+        return self.ids[self.alive & (self.host == host)]
+
+    def heirs(self, character_id, max_depth = 2, male_first = True) :
+        """
+            Living descendants of character_id in a primogeniture-like order:
+            closer generations first, then males first if male_first, then by
+            birth date. Realm laws are not taken into account.
+        """
+        generation = self.index_of(character_id)
+        generation = generation[generation >= 0]
+        candidates = []
+        for depth in range(max_depth) :
+            generation = np.unique(self.children_of(generation))
+            if not len(generation) :
+                break
+            living = generation[self.alive[generation]]
+            keys = [self.birth[living]]
+            if male_first :
+                keys.append(self.female[living])
+            candidates.append(living[np.lexsort(keys)])
+        if not candidates :
+            return self.ids[:0]
+        return self.ids[np.concatenate(candidates)]
+
+    # Shared ancestry
+    def ancestor_matrix(self, generations = 3) :
+        """
+            Positions of every ancestor up to generations back, one row per
+            character: parents in columns 0-1, grandparents in 2-5 and so on.
+            Unknown ancestors are -1.
+        """
+        if generations not in self.ancestor_matrices :
+            levels = [np.vstack([self.father, self.mother]).T]
+            for level in range(1, generations) :
+                previous = levels[-1]
+                known = previous >= 0
+                safe = np.where(known, previous, 0)
+                fathers = np.where(known, self.father[safe], -1)
+                mothers = np.where(known, self.mother[safe], -1)
+                levels.append(np.hstack([fathers, mothers]))
+            self.ancestor_matrices[generations] = np.hstack(levels).astype(np.int32)
+        return self.ancestor_matrices[generations]
+
+    def share_ancestors(self, first, second, generations = 3) :
+        """
+            For each pair first[i], second[i] of positions, True if both share
+            an ancestor within generations, or one is an ancestor of the other.
+        """
+        first = np.asarray(first, dtype = np.int32)
+        second = np.asarray(second, dtype = np.int32)
+        matrix = self.ancestor_matrix(generations)
+        valid = (first >= 0) & (second >= 0)
+        result = np.zeros(len(first), dtype = np.bool_)
+        if not valid.any() :
+            return result
+        first = first[valid]
+        second = second[valid]
+        # Each side is the character itself plus its ancestors
+        lines1 = np.hstack([first[:, None], matrix[first]])
+        lines2 = np.hstack([second[:, None], matrix[second]])
+        equal = (lines1[:, :, None] == lines2[:, None, :]) & (lines1[:, :, None] >= 0)
+        result[valid] = equal.any(axis = 2).any(axis = 1)
+        return result
+
+    def inbreeding_risk(self, generations = 3, living = True) :
+        """ Ids of characters whose parents share an ancestor within generations. """
+        both = (self.father >= 0) & (self.mother >= 0)
+        if living :
+            both &= self.alive
+        positions = np.nonzero(both)[0]
+        risky = self.share_ancestors(self.father[positions], self.mother[positions], generations)
+        return self.ids[positions[risky]]
+
+    def marriage_risk(self, character_id, candidate_ids, generations = 3) :
+        """ For each candidate, True if a marriage to character_id would be inbred. """
+        candidates = self.index_of(candidate_ids)
+        character = np.repeat(self.index_of(character_id), len(candidates))
+        return self.share_ancestors(character, candidates, generations)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+# ck2_nodes loads every element of a CK2 saved game into a generic node table.
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+
+from .ck2_file_parser import ck2_parser, cp
+
+# Tokens of a line: quoted strings, brackets, equal signs and bare words
+token_pattern = re.compile(r'"[^"]*"|[{}=]|[^\s{}="]+')
+
+def split_statements(line) :
+    """
+        Splits a line holding several key = value pairs, like
+        "b = { x = 1 y = 2 }", into one line per pair or bracket. The line
+        patterns of ck2_parser would read it as a single value. Returns an
+        empty list for other lines, which are read as they are.
+    """
+    tokens = token_pattern.findall(cp.sub('', line))
+    if tokens.count('=') < 2 :
+        return []
+    statements = []
+    values = []
+    i = 0
+    while i < len(tokens) :
+        token = tokens[i]
+        is_key = i + 1 < len(tokens) and tokens[i + 1] == '='
+        if token not in "{}" and not is_key :
+            values.append(token)
+            i += 1
+        elif token == '}' :
+            # Values before a bracket are closed with it ("1 2 3 }")
+            statements.append(" ".join(values + [token]))
+            values = []
+            i += 1
+        else :
+            if values :
+                statements.append(" ".join(values))
+                values = []
+            if token == '{' :
+                statements.append(token)
+                i += 1
+            elif i + 2 < len(tokens) and tokens[i + 2] != '}' :
+                statements.append("%s = %s" % (token, tokens[i + 2]))
+                i += 3
+            else :
+                statements.append("%s =" % (token))
+                i += 2
+    if values :
+        statements.append(" ".join(values))
+    return statements
+
+
+class ck2_node_loader(ck2_parser) :
+    """
+        ck2_node_loader keeps the whole tree of a saved game instead of the
+        blocks ck2_db knows about. Every element and value is a row of the
+        node table: (id, parent_id, key_id, value, position). Keys are
+        stored once in node_key, and node_view joins both.
+
+        Rows are written with executemany in batches to temporary tables,
+        with ids of their own. Once the file is read, they are copied to the
+        node tables in a single transaction, which gives them the next free
+        ids, so several loaders can write to the same database. Loading a
+        file again replaces its earlier tree, found by the id range kept in
+        node_file. The indexes are created again after the copy.
+
+        dbconn : sqlite3 connection of the output database
+        drop_tables : drop the node tables before loading
+        batch_size : number of rows written per executemany
+    """
+    indexes = {
+        'node_parent' : "node (parent_id, position)",
+        'node_key_value' : "node (key_id, value)",
+    }
+
+    def __init__(self, dbconn, drop_tables = False, batch_size = 10000) :
+        ck2_parser.__init__(self, None)
+        self.conn = dbconn
+        self.c = self.conn.cursor()
+        self.batch_size = max(1, batch_size)
+
+        if drop_tables :
+            for table_name in ['node', 'node_key', 'node_file'] :
+                self.c.execute("DROP TABLE IF EXISTS %s" % (table_name))
+            self.c.execute("DROP VIEW IF EXISTS node_view")
+        self.c.execute("CREATE TABLE IF NOT EXISTS node (id INTEGER PRIMARY KEY, parent_id INTEGER, key_id INTEGER, value TEXT, position INTEGER)")
+        self.c.execute("CREATE TABLE IF NOT EXISTS node_key (id INTEGER PRIMARY KEY, name TEXT UNIQUE)")
+        self.c.execute("CREATE TABLE IF NOT EXISTS node_file (path, root_id INTEGER, first_id INTEGER, last_id INTEGER)")
+        existing = [row[1] for row in self.c.execute("PRAGMA table_info(node_file)").fetchall()]
+        for column in ['first_id INTEGER', 'last_id INTEGER'] :
+            if column.split()[0] not in existing :
+                self.c.execute("ALTER TABLE node_file ADD COLUMN %s" % (column))
+        self.c.execute("""CREATE VIEW IF NOT EXISTS node_view AS SELECT n.id, n.parent_id, k.name key, n.value, n.position
+            FROM node n JOIN node_key k ON k.id = n.key_id""")
+        # Rows of the file being loaded, and the keys they use
+        self.c.execute("DROP TABLE IF EXISTS temp.node_load")
+        self.c.execute("DROP TABLE IF EXISTS temp.node_load_key")
+        self.c.execute("CREATE TEMP TABLE node_load (id INTEGER PRIMARY KEY, parent_id INTEGER, key_id INTEGER, value TEXT, position INTEGER)")
+        self.c.execute("CREATE TEMP TABLE node_load_key (id INTEGER PRIMARY KEY, name TEXT)")
+        self.conn.commit()
+
+        self.keys = {}
+        self.next_key_id = 1
+        self.new_keys = []
+        self.rows = []
+        self.node_count = 0
+        self.next_id = 1
+
+        # Open elements, as [id, parent_id, key_id, value, position, child count]
+        self.open_nodes = []
+        # Last closed element and the line it was closed on. Its row waits
+        # in case a value follows the bracket on the same line ("1 2 3 }").
+        self.closed_node = None
+        self.closed_line = 0
+
+    def get_key_id(self, key) :
+        key_id = self.keys.get(key)
+        if key_id is None :
+            key_id = self.next_key_id
+            self.next_key_id += 1
+            self.keys[key] = key_id
+            self.new_keys.append((key_id, key))
+        return key_id
+
+    def new_node(self, key, value = None) :
+        if self.open_nodes :
+            parent = self.open_nodes[-1]
+            parent_id = parent[0]
+            position = parent[5]
+            parent[5] += 1
+        else :
+            parent_id = None
+            position = 0
+        node = [self.next_id, parent_id, self.get_key_id(key), value, position, 0]
+        self.next_id += 1
+        return node
+
+    def write_node(self, node) :
+        self.rows.append(tuple(node[0:5]))
+        self.node_count += 1
+        if len(self.rows) >= self.batch_size :
+            self.flush()
+
+    def write_closed_node(self) :
+        if self.closed_node is not None :
+            self.write_node(self.closed_node)
+            self.closed_node = None
+
+    def flush(self) :
+        if self.new_keys :
+            self.c.executemany("INSERT INTO temp.node_load_key (id, name) VALUES (?, ?)", self.new_keys)
+            self.new_keys = []
+        if self.rows :
+            self.c.executemany("INSERT INTO temp.node_load (id, parent_id, key_id, value, position) VALUES (?, ?, ?, ?, ?)", self.rows)
+            self.rows = []
+        self.conn.commit()
+
+    # ck2_parser hooks
+    def process_line(self, line) :
+        statements = split_statements(line)
+        if not statements :
+            ck2_parser.process_line(self, line)
+            return
+        # Every statement is read as a line of its own, so a bracket closed
+        # by one isn't given the value of the next. line_count still counts
+        # the lines of the file.
+        line_count = self.line_count
+        for statement in statements :
+            ck2_parser.process_line(self, statement)
+        self.write_closed_node()
+        self.line_count = line_count + 1
+
+    def add_level(self, key) :
+        self.write_closed_node()
+        self.open_nodes.append(self.new_node(key))
+        ck2_parser.add_level(self, key)
+
+    def add_value(self, key, value) :
+        node_value = value.strip() if value else value
+        if self.closed_node is not None and self.closed_line == self.line_count and self.keys.get(key) == self.closed_node[2] :
+            self.closed_node[3] = node_value
+            self.write_closed_node()
+        else :
+            self.write_closed_node()
+            self.write_node(self.new_node(key, node_value))
+        ck2_parser.add_value(self, key, value)
+
+    def end_element(self) :
+        self.write_closed_node()
+        ck2_parser.end_element(self)
+        if self.open_nodes :
+            self.closed_node = self.open_nodes.pop()
+            self.closed_line = self.line_count
+
+    def save_element_to_db(self, dict = None, tag = None) :
+        pass
+
+    def parse_file(self, path, root = "CK2_Save_game", resume = False) :
+        # Nodes are written in batches without checkpoints, so resume is ignored
+        self.load_file(path, root)
+
+    def load_file(self, path, root = "CK2_Save_game") :
+        path = os.path.abspath(path)
+        self.open_nodes = []
+        self.closed_node = None
+        self.next_id = 1
+        node_count = self.node_count
+        self.c.execute("DELETE FROM temp.node_load")
+
+        self.start_file(root)
+        for offset in self.read_lines(path) :
+            pass
+
+        # Close what is left open, the root and any unbalanced brackets
+        self.write_closed_node()
+        while self.open_nodes :
+            self.write_node(self.open_nodes.pop())
+        self.flush()
+        self.save_nodes(path, self.next_id - 1)
+        self.c.execute("DELETE FROM temp.node_load")
+        self.conn.commit()
+        print "Loaded %i nodes from %s" % (self.node_count - node_count, path)
+
+    def save_nodes(self, path, count) :
+        # Copies the nodes of path from the temporary tables, in a single
+        # transaction. Its first statement takes the write lock, so the ids
+        # read next are not taken by another loader.
+        self.c.execute("INSERT OR IGNORE INTO node_key (name) SELECT name FROM temp.node_load_key ORDER BY id")
+        for name in self.indexes.keys() :
+            self.c.execute("DROP INDEX IF EXISTS %s" % (name))
+        for first_id, last_id in self.c.execute("SELECT first_id, last_id FROM node_file WHERE path = ?", (path,)).fetchall() :
+            self.c.execute("DELETE FROM node WHERE id BETWEEN ? AND ?", (first_id, last_id))
+        self.c.execute("DELETE FROM node_file WHERE path = ?", (path,))
+        base = self.c.execute("SELECT coalesce(max(id), 0) FROM node").fetchone()[0]
+        self.c.execute("""INSERT INTO node (id, parent_id, key_id, value, position)
+            SELECT n.id + ?, n.parent_id + ?, k.id, n.value, n.position FROM temp.node_load n
+            JOIN temp.node_load_key l ON l.id = n.key_id JOIN node_key k ON k.name = l.name""", (base, base))
+        # The root is the first node of the file
+        self.c.execute("INSERT INTO node_file (path, root_id, first_id, last_id) VALUES (?, ?, ?, ?)",
+            (path, base + 1, base + 1, base + count))
+        for name, definition in self.indexes.items() :
+            self.c.execute("CREATE INDEX IF NOT EXISTS %s ON %s" % (name, definition))
+        self.conn.commit()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+# ck2_service serves read only queries over a loaded CK2 database as JSON over HTTP.
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import Queue
+import sqlite3
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+from .ck2_cache import lru_cache
+from .ck2_file_parser import file_signature
+from .ck2_shards import attach_shards, detach_shards, find_shard_paths
+
+# Named queries over the views created by ck2_db. Every parameter is
+# optional unless listed in required, and a missing one doesn't filter.
+queries = {
+    'single_claimants' : {
+        'sql' : """SELECT * FROM single_claimants
+            WHERE (:title IS NULL OR title_claim = :title) AND (:culture IS NULL OR culture = :culture)
+            AND (:religion IS NULL OR religion = :religion) AND (:female IS NULL OR female = :female)""",
+        'params' : ['title', 'culture', 'religion', 'female'],
+    },
+    'marry_into_title' : {
+        'sql' : """SELECT * FROM marry_into_title
+            WHERE (:title IS NULL OR title_id = :title) AND (:culture IS NULL OR culture = :culture)
+            AND (:religion IS NULL OR religion = :religion)""",
+        'params' : ['title', 'culture', 'religion'],
+    },
+    'single_dynasts' : {
+        'sql' : """SELECT * FROM single_dynasts WHERE (:female IS NULL OR female = :female)""",
+        'params' : ['female'],
+    },
+    'live_dynasts' : {
+        'sql' : """SELECT * FROM live_dynasts WHERE (:status IS NULL OR status = :status)""",
+        'params' : ['status'],
+    },
+    'exiled_ruler_single_child' : {
+        'sql' : """SELECT * FROM exiled_ruler_single_child
+            WHERE (:culture IS NULL OR culture = :culture) AND (:religion IS NULL OR religion = :religion)""",
+        'params' : ['culture', 'religion'],
+    },
+    'family_tree' : {
+        'sql' : """SELECT * FROM family_tree WHERE id = :id""",
+        'params' : ['id'],
+        'required' : ['id'],
+    },
+    'character' : {
+        'sql' : """SELECT * FROM character_view WHERE id = :id""",
+        'params' : ['id'],
+        'required' : ['id'],
+    },
+    'dynasty' : {
+        'sql' : """SELECT * FROM dynasty_view WHERE (:id IS NULL OR id = :id) AND (:culture IS NULL OR culture = :culture)""",
+        'params' : ['id', 'culture'],
+    },
+}
+
+class query_error(Exception) :
+    pass
+
+class ck2_query_service :
+    """
+        ck2_query_service runs the named queries against a pool of read only
+        connections and keeps their results in an LRU cache.
+
+        The cache is cleared whenever another connection commits to the
+        database, which is detected with PRAGMA data_version, or changes
+        its shard files. Shards kept by ck2_file_parser --keep-shards are
+        attached to every connection, and attached again after a change.
+
+        path : path of the database loaded by ck2_parser
+        pool_size : number of read only connections
+        cache_size : number of results kept in memory
+        limit : maximum number of rows returned by a query
+    """
+    def __init__(self, path, pool_size = 4, cache_size = 256, limit = 10000) :
+        self.path = path
+        self.limit = limit
+        self.cache = lru_cache(cache_size)
+        self.version_conn = sqlite3.connect(self.path, check_same_thread = False)
+        self.version_lock = threading.Lock()
+        self.data_version = self.get_data_version()
+        # Pooled connections as (connection, data_version of their shards)
+        self.pool = Queue.Queue()
+        for i in range(max(1, pool_size)) :
+            self.pool.put((self.connect(), self.data_version))
+
+    def connect(self) :
+        conn = sqlite3.connect(self.path, check_same_thread = False)
+        # Tables kept in shards are only seen through the temporary views
+        # of attach_shards, which have to exist on every connection
+        attach_shards(conn, self.path)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def reattach(self, conn) :
+        # Shard files may have been added, folded or deleted
+        conn.execute("PRAGMA query_only = OFF")
+        detach_shards(conn)
+        attach_shards(conn, self.path)
+        conn.execute("PRAGMA query_only = ON")
+
+    def get_data_version(self) :
+        # Shards are written by other connections than the database, so
+        # their files are compared by size and modification time
+        shards = sorted((path, file_signature(path)) for paths in find_shard_paths(self.path).values() for path in paths)
+        return self.version_conn.execute("PRAGMA data_version").fetchone()[0], shards
+
+    def check_version(self) :
+        """ Returns the current data_version. Cached results of another one are stale. """
+        with self.version_lock :
+            version = self.get_data_version()
+            if version != self.data_version :
+                self.data_version = version
+                self.cache.clear()
+            return version
+
+    def run_query(self, name, params = None) :
+        """ Returns (columns, rows, cached) for the named query. """
+        query = queries.get(name)
+        if query is None :
+            raise query_error("Unknown query %s" % (name))
+        params = params or {}
+        unknown = set(params.keys()) - set(query['params'])
+        if unknown :
+            raise query_error("Unknown parameters for %s: %s" % (name, ", ".join(sorted(unknown))))
+        for param in query.get('required', []) :
+            if params.get(param) is None :
+                raise query_error("Missing parameter for %s: %s" % (name, param))
+        values = dict((param, params.get(param)) for param in query['params'])
+
+        version = self.check_version()
+        key = (name, tuple(sorted(values.items())))
+        result = self.cache.get(key)
+        if result is not None :
+            return result[0], result[1], True
+
+        conn, conn_version = self.pool.get()
+        try :
+            if conn_version != version :
+                self.reattach(conn)
+                conn_version = version
+            cursor = conn.execute("%s LIMIT %i" % (query['sql'], self.limit), values)
+            columns = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+        finally :
+            self.pool.put((conn, conn_version))
+        # Only kept if nothing was committed while the query ran
+        if self.check_version() == version :
+            self.cache.put(key, (columns, rows))
+        return columns, rows, False
+
+    def close(self) :
+        while not self.pool.empty() :
+            self.pool.get()[0].close()
+        self.version_conn.close()
+
+class query_request_handler(BaseHTTPServer.BaseHTTPRequestHandler) :
+    """
+        GET /queries lists the named queries and their parameters.
+        GET /query/<name>?<param>=<value> runs a named query.
+    """
+    def send_json(self, status, content) :
+        body = json.dumps(content)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) :
+        url = urlparse.urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        if parts == ['queries'] :
+            self.send_json(200, dict((name, query['params']) for name, query in queries.items()))
+        elif len(parts) == 2 and parts[0] == 'query' :
+            params = dict((key, values[-1]) for key, values in urlparse.parse_qs(url.query).items())
+            try :
+                columns, rows, cached = self.server.service.run_query(parts[1], params)
+            except query_error as error :
+                self.send_json(400, {'error' : str(error)})
+                return
+            except sqlite3.Error as error :
+                self.send_json(500, {'error' : str(error)})
+                return
+            self.send_json(200, {'query' : parts[1], 'columns' : columns, 'rows' : rows, 'cached' : cached})
+        else :
+            self.send_json(404, {'error' : "Not found: %s" % (url.path)})
+
+    def log_message(self, format, *args) :
+        pass
+
+class query_server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer) :
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, service, host = "127.0.0.1", port = 8642) :
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), query_request_handler)
+        self.service = service
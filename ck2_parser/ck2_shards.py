@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+# ck2_shards splits the output database in one file per group of tables.
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import sqlite3
+import itertools
+
+from .ck2_file_parser import encoded_fields
+
+# Tables written to each shard. Tables not listed stay in the main database.
+shard_groups = {
+    'character' : ['character', 'historic_character'],
+    'title' : ['title', 'landed_title', 'claim'],
+    'dynasty' : ['dynasty', 'historic_dynasty'],
+    'province' : ['province'],
+}
+
+# A writer that doesn't touch the output database (a --watch worker) keeps
+# the other tables, the lookups and source_file in a private main shard.
+private_group = 'main'
+
+# Tables of a private main shard that are merged by their own rules
+merged_apart = ['source_file', 'parse_checkpoint', 'sqlite_sequence']
+
+# Seconds a connection waits for another writer of the same database
+DB_TIMEOUT = 600
+
+# Every writer has its own shard files, named after its writer id
+writer_counter = itertools.count(1)
+
+# Shards kept for readers are folded into one file per group, named after
+# this writer id. SQLite attaches at most MAX_ATTACHED databases.
+kept_writer = 'kept'
+MAX_ATTACHED = 10
+
+def new_writer_id() :
+    # Unique across processes (pid) and within one (counter)
+    return "w%i_%i" % (os.getpid(), next(writer_counter))
+
+def get_shard_path(outputfile, group, writer) :
+    base, extension = os.path.splitext(outputfile)
+    return "%s.%s.%s%s" % (base, writer, group, extension or ".db")
+
+def get_shard_paths(outputfile, writer) :
+    return dict((group, get_shard_path(outputfile, group, writer)) for group in shard_groups.keys() + [private_group])
+
+def find_shard_paths(outputfile) :
+    """ Returns a dict of group -> paths of the shards of every writer of outputfile. """
+    base, extension = os.path.splitext(os.path.abspath(outputfile))
+    pattern = re.compile(r"^%s\.(w\d+_\d+|%s)\.(%s)%s$" % (re.escape(os.path.basename(base)), kept_writer,
+        "|".join(sorted(shard_groups.keys())), re.escape(extension or ".db")))
+    found = {}
+    directory = os.path.dirname(base)
+    for name in sorted(os.listdir(directory)) :
+        match = pattern.match(name)
+        if match :
+            found.setdefault(match.group(2), []).append(os.path.join(directory, name))
+    return found
+
+def open_shards(outputfile, writer) :
+    """
+        Opens one connection per shard group of writer. Returns a dict of
+        table name -> connection, as expected by ck2_db.
+    """
+    shards = {}
+    for group in shard_groups.keys() :
+        conn = sqlite3.connect(get_shard_path(outputfile, group, writer), timeout = DB_TIMEOUT)
+        for table_name in shard_groups[group] :
+            shards[table_name] = conn
+    return shards
+
+def close_shards(shards) :
+    for conn in set(shards.values()) :
+        conn.commit()
+        conn.close()
+
+def remove_shards(outputfile, writer) :
+    for path in get_shard_paths(outputfile, writer).values() :
+        if os.path.exists(path) :
+            os.remove(path)
+
+def remove_all_shards(outputfile) :
+    # Shards of every writer, kept ones included. Their rows belong to the
+    # tables a rewrite drops.
+    for paths in find_shard_paths(outputfile).values() :
+        for path in paths :
+            os.remove(path)
+
+def get_tables(conn, schema) :
+    sql = "SELECT name FROM %s.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%%'" % (schema)
+    return [row[0] for row in conn.execute(sql)]
+
+def get_columns(conn, schema, table_name) :
+    return [row[1] for row in conn.execute("PRAGMA %s.table_info(%s)" % (schema, table_name))]
+
+def merge_sources(conn, schema) :
+    # Files loaded by the writer replace the rows of their earlier load
+    tables = [table_name for table_name in get_tables(conn, "main") if 'source_id' in get_columns(conn, "main", table_name)]
+    for (path,) in conn.execute("SELECT path FROM %s.source_file" % (schema)).fetchall() :
+        row = conn.execute("SELECT id FROM main.source_file WHERE path = ?", (path,)).fetchone()
+        if row :
+            for table_name in tables :
+                conn.execute("DELETE FROM main.%s WHERE source_id = ?" % (table_name), row)
+            conn.execute("DELETE FROM main.source_file WHERE id = ?", row)
+    conn.execute("INSERT INTO main.source_file (path, loaded_at) SELECT path, loaded_at FROM %s.source_file" % (schema))
+
+def get_merge_select(conn, schema, table_name, private) :
+    # Ids of a private main shard are given again by the output database:
+    # source_id through source_file.path, encoded columns through the
+    # lookup names.
+    remap = {}
+    if private :
+        remap['source_id'] = ("source_file", "path")
+        if table_name.endswith("_data") :
+            for field, domain in encoded_fields.get(table_name[:-len("_data")], {}).items() :
+                remap[field] = (domain + "_lookup", "name")
+    columns = get_columns(conn, schema, table_name)
+    select = []
+    for column in columns :
+        if column in remap :
+            lookup, key = remap[column]
+            select.append("(SELECT m.id FROM main.%s m JOIN %s.%s p ON p.%s = m.%s WHERE p.id = d.%s)" % (
+                lookup, private, lookup, key, key, column))
+        else :
+            select.append("d.%s" % (column))
+    return "INSERT INTO main.%s (%s) SELECT %s FROM %s.%s d" % (table_name, ", ".join(columns), ", ".join(select), schema, table_name)
+
+def merge_shards(conn, outputfile, writer, remove = True) :
+    """
+        Copies the rows of the shards of writer into the matching tables of
+        conn, the main database, in a single transaction. Then deletes the
+        shard files. Shards of other writers are left alone.
+
+        When the writer has a private main shard, the files it loaded
+        replace their earlier rows, and source and lookup ids are mapped to
+        the ids of the main database.
+    """
+    paths = [(group, path) for group, path in sorted(get_shard_paths(outputfile, writer).items()) if os.path.exists(path)]
+    conn.commit()
+    schemas = []
+    try :
+        for group, path in paths :
+            schema = "shard_%s" % (group)
+            conn.execute("ATTACH DATABASE ? AS %s" % (schema), (path,))
+            schemas.append((group, schema))
+
+        private = None
+        if private_group in dict(schemas) :
+            private = dict(schemas)[private_group]
+            merge_sources(conn, private)
+            for table_name in get_tables(conn, private) :
+                if table_name.endswith("_lookup") :
+                    conn.execute("INSERT OR IGNORE INTO main.%s (name) SELECT name FROM %s.%s ORDER BY id" % (table_name, private, table_name))
+
+        for group, schema in schemas :
+            for table_name in get_tables(conn, schema) :
+                if schema == private and (table_name in merged_apart or table_name.endswith("_lookup")) :
+                    continue
+                cursor = conn.execute(get_merge_select(conn, schema, table_name, private))
+                if cursor.rowcount > 0 :
+                    print "Merged %i rows of %s from %s" % (cursor.rowcount, table_name, writer)
+        conn.commit()
+    except :
+        conn.rollback()
+        raise
+    finally :
+        for group, schema in schemas :
+            conn.execute("DETACH DATABASE %s" % (schema))
+    if remove :
+        remove_shards(outputfile, writer)
+
+def fold_shards(outputfile, writer) :
+    """
+        Moves the rows of the shards of writer to the kept shards of
+        outputfile, one file per group, which attach_shards reads. Rows of
+        files loaded again since are dropped from the kept shards. Then
+        deletes the shard files of writer.
+    """
+    create_table = re.compile(r"^\s*CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?", re.IGNORECASE)
+    for group, path in sorted(get_shard_paths(outputfile, writer).items()) :
+        if group == private_group or not os.path.exists(path) :
+            continue
+        conn = sqlite3.connect(get_shard_path(outputfile, group, kept_writer), timeout = DB_TIMEOUT)
+        try :
+            conn.execute("ATTACH DATABASE ? AS output", (outputfile,))
+            conn.execute("ATTACH DATABASE ? AS shard", (path,))
+            for table_name in get_tables(conn, "shard") :
+                sql = conn.execute("SELECT sql FROM shard.sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone()[0]
+                conn.execute(create_table.sub("CREATE TABLE IF NOT EXISTS ", sql))
+                kept_columns = get_columns(conn, "main", table_name)
+                columns = get_columns(conn, "shard", table_name)
+                for column in columns :
+                    if column not in kept_columns :
+                        conn.execute("ALTER TABLE main.%s ADD COLUMN %s" % (table_name, column))
+                if 'source_id' in columns :
+                    conn.execute("DELETE FROM main.%s WHERE source_id NOT IN (SELECT id FROM output.source_file)" % (table_name))
+                cursor = conn.execute(get_merge_select(conn, "shard", table_name, None))
+                if cursor.rowcount > 0 :
+                    print "Kept %i rows of %s from %s" % (cursor.rowcount, table_name, writer)
+            conn.commit()
+            conn.execute("DETACH DATABASE shard")
+            conn.execute("DETACH DATABASE output")
+        finally :
+            conn.close()
+    remove_shards(outputfile, writer)
+
+def attach_shards(conn, outputfile) :
+    """
+        Attaches the kept shards of every writer of outputfile to conn, and
+        shadows the tables of the main database with temporary views over
+        the main table and the shards. Rows of files loaded again since are
+        left out.
+
+        Views stored in the main database only see main tables, so they are
+        copied as temporary views too. The views only last as long as conn:
+        every reader of a database with kept shards must call attach_shards,
+        a plain sqlite3.connect sees the main tables only.
+
+        Shards of writers that are still loading, or were stopped, are
+        attached too. Raises an exception when there are more shard files
+        than SQLite can attach.
+    """
+    found = find_shard_paths(outputfile)
+    attached = len([row for row in conn.execute("PRAGMA database_list") if row[1] not in ('main', 'temp')])
+    if sum(len(paths) for paths in found.values()) > MAX_ATTACHED - attached :
+        raise Exception("%s has more shard files than SQLite can attach. Merge them with merge_shards" % (outputfile))
+    tables = {}
+    for group, paths in sorted(found.items()) :
+        for number, path in enumerate(paths) :
+            schema = "shard_%s_%i" % (group, number)
+            conn.execute("ATTACH DATABASE ? AS %s" % (schema), (path,))
+            for table_name in get_tables(conn, schema) :
+                tables.setdefault(table_name, []).append(schema)
+    if not tables :
+        return
+
+    for table_name, schemas in sorted(tables.items()) :
+        selects = ["SELECT * FROM main.%s" % (table_name)]
+        for schema in schemas :
+            selects.append("SELECT * FROM %s.%s WHERE source_id IN (SELECT id FROM main.source_file)" % (schema, table_name))
+        conn.execute("CREATE TEMP VIEW %s AS %s" % (table_name, " UNION ALL ".join(selects)))
+
+    create_view = re.compile(r"^\s*CREATE\s+VIEW\s+(IF\s+NOT\s+EXISTS\s+)?", re.IGNORECASE)
+    for name, sql in conn.execute("SELECT name, sql FROM main.sqlite_master WHERE type = 'view' ORDER BY rowid").fetchall() :
+        conn.execute(create_view.sub("CREATE TEMP VIEW ", sql))
+
+def detach_shards(conn) :
+    """ Drops the temporary views of attach_shards and detaches the shards from conn. """
+    for (name,) in conn.execute("SELECT name FROM temp.sqlite_master WHERE type = 'view'").fetchall() :
+        conn.execute("DROP VIEW temp.%s" % (name))
+    for row in conn.execute("PRAGMA database_list").fetchall() :
+        if row[1].startswith("shard_") :
+            conn.execute("DETACH DATABASE %s" % (row[1]))
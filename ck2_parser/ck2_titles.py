@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# ck2_titles answers de jure and de facto title hierarchy questions over a loaded CK2 database.
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+from .ck2_cache import lru_cache
+from .ck2_genealogy import build_closure_table, table_exists
+
+
+class ck2_title_hierarchy :
+    """
+        ck2_title_hierarchy answers liege and vassal queries from two closure
+        tables built once after a save is loaded:
+
+        title_dejure_closure : from landed_title.de_jure_liege
+        title_defacto_closure : from title.liege
+
+        Both hold (ancestor, descendant, depth, paths) rows, where the ancestor is
+        the liege title. Tiers are taken from the title prefix (b, c, d, k, e).
+
+        dbconn : sqlite3 connection to a database loaded by ck2_parser
+        cache_size : number of lookups kept in memory
+    """
+    hierarchies = {
+        'dejure' : ("title_dejure_closure", """SELECT title_id, de_jure_liege FROM landed_title
+            WHERE title_id IS NOT NULL AND de_jure_liege IS NOT NULL"""),
+        'defacto' : ("title_defacto_closure", """SELECT id, liege FROM title
+            WHERE id IS NOT NULL AND liege IS NOT NULL"""),
+    }
+
+    def __init__(self, dbconn, cache_size = 10000) :
+        self.conn = dbconn
+        self.cache = lru_cache(cache_size)
+
+    def build(self, rebuild = True, max_depth = 16) :
+        for name, (table_name, edge_query) in self.hierarchies.items() :
+            if rebuild or not table_exists(self.conn, table_name) :
+                build_closure_table(self.conn, table_name, edge_query, max_depth, "TEXT")
+        self.cache.clear()
+
+    def get_table(self, de_jure) :
+        if de_jure :
+            return self.hierarchies['dejure'][0]
+        return self.hierarchies['defacto'][0]
+
+    def get_vassals(self, title_id, de_jure = False, tier = None, max_depth = None) :
+        """ Returns a list of (title, depth) under title_id. Direct vassals are depth 1. """
+        sql = "SELECT descendant, depth FROM %s WHERE ancestor = ?" % (self.get_table(de_jure))
+        params = (title_id,)
+        if max_depth :
+            sql += " AND depth <= ?"
+            params += (max_depth,)
+        if tier :
+            sql += " AND substr(descendant, 1, 2) = ?"
+            params += (tier + "_",)
+        sql += " ORDER BY depth, descendant"
+        return self.cache.fetchall(self.conn, ('vassals', title_id, de_jure, tier, max_depth), sql, params)
+
+    def get_lieges(self, title_id, de_jure = False) :
+        """ Returns a list of (title, depth) above title_id, the direct liege first. """
+        sql = "SELECT ancestor, depth FROM %s WHERE descendant = ? ORDER BY depth" % (self.get_table(de_jure))
+        return self.cache.fetchall(self.conn, ('lieges', title_id, de_jure), sql, (title_id,))
+
+    def get_top_liege(self, title_id, de_jure = False) :
+        """ Returns the highest liege of title_id, or title_id itself if it has none. """
+        lieges = self.get_lieges(title_id, de_jure)
+        if lieges :
+            return lieges[-1][0]
+        return title_id
+
+    def get_realm_size(self, title_id, tier = "c", de_jure = False) :
+        """ Number of titles of a tier under title_id, including itself. """
+        count = len(self.get_vassals(title_id, de_jure, tier))
+        if title_id.startswith(tier + "_") :
+            count += 1
+        return count
+
+    def get_realm_sizes(self, tier = "c", de_jure = False) :
+        """ Returns (top title, count) for every title without a liege, largest first. """
+        table_name = self.get_table(de_jure)
+        sql = """SELECT ancestor, count(*) size FROM %s
+            WHERE substr(descendant, 1, 2) = ?
+            AND ancestor NOT IN (SELECT descendant FROM %s)
+            GROUP BY ancestor ORDER BY size DESC, ancestor""" % (table_name, table_name)
+        return self.cache.fetchall(self.conn, ('realm_sizes', tier, de_jure), sql, (tier + "_",))
@@ -24,9 +24,6 @@ import re
 
 import sys
 
-reload(sys)
-sys.setdefaultencoding('utf-8')
-
 """
     ck2_2_XML_stream reads a ck2 saved game stream and, parses it and writes to an 
     xml stream.
@@ -148,31 +145,39 @@ def ck2_2_XML_stream (f, out) :
 
 ## MAIN SECTION ##
 
-# Choose Saved Game file
-from Tkinter import Tk
-from tkFileDialog import askopenfilename, askdirectory
+def main() :
+    reload(sys)
+    sys.setdefaultencoding('utf-8')
+
+    # Choose Saved Game file
+    from Tkinter import Tk
+    from tkFileDialog import askopenfilename, askdirectory
+
+    #Tk().withdraw() # we don't want a full GUI, so keep the root window from appearing
+    root=Tk()
+    root.withdraw()
+    save_file_path = askopenfilename(parent=root)
+    # save_file_path = "" # use \\ to escape backslash in windows.
 
-#Tk().withdraw() # we don't want a full GUI, so keep the root window from appearing
-root=Tk()
-root.withdraw()
-save_file_path = askopenfilename(parent=root)
-# save_file_path = "" # use \\ to escape backslash in windows.
+    print save_file_path
 
-print save_file_path
+    #base_file_name = save_file_path.split("\\")[-1]
+    xml_file_name = "saved_game" + ".xml"
 
-#base_file_name = save_file_path.split("\\")[-1]
-xml_file_name = "saved_game" + ".xml"
+    print xml_file_name
 
-print xml_file_name
+    root.withdraw()
+    xml_folder_path = askdirectory(parent=root)
+    # xml_folder_path = ""  # use \\ to escape backslash in windows.
+    #os.chdir(xml_folder_path)
 
-root.withdraw()
-xml_folder_path = askdirectory(parent=root)
-# xml_folder_path = ""  # use \\ to escape backslash in windows.
-#os.chdir(xml_folder_path)
+    print xml_folder_path
 
-print xml_folder_path
+    with io.open(xml_file_name, "wb") as out :
+        import codecs
+        with codecs.open(save_file_path,"r","latin-1") as f :
+            ck2_2_XML_stream(f, out)
 
-with io.open(xml_file_name, "wb") as out :
-    import codecs
-    with codecs.open(save_file_path,"r","latin-1") as f :
-        ck2_2_XML_stream(f, out)
+# Tk is only started when the script is run, not when the module is imported
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+# ck2_watch loads new CK2 saved games from a directory as they are written.
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import fnmatch
+import sqlite3
+import multiprocessing
+
+from .ck2_file_parser import ck2_parser, file_signature
+from .ck2_shards import new_writer_id, get_shard_path, private_group, open_shards, close_shards, remove_shards, merge_shards
+
+# Seconds a connection waits for another writer before giving up
+DB_TIMEOUT = 600
+
+def ingest_file(path, outputfile, root = None, encode_strings = False, checkpoint_elements = 0, checkpoint_seconds = 0, shards = False) :
+    """
+        Loads a single saved game. Runs in a worker process. The rows of an
+        earlier load of path are replaced.
+
+        With checkpoints, a load interrupted by a crash is resumed, unless
+        the file changed since.
+
+        With shards, nothing is written to outputfile: the rows go to shard
+        files of a new writer, and its id is returned for merge_shards.
+    """
+    writer = None
+    shard_conns = None
+    if shards :
+        writer = new_writer_id()
+        conn = sqlite3.connect(get_shard_path(outputfile, private_group, writer))
+        shard_conns = open_shards(outputfile, writer)
+    else :
+        conn = sqlite3.connect(outputfile, timeout = DB_TIMEOUT)
+    try :
+        # The tables are never dropped here, other workers are using them
+        ck2p = ck2_parser(conn, False, checkpoint_elements, checkpoint_seconds, encode_strings, shard_conns)
+        resume = bool(checkpoint_elements or checkpoint_seconds)
+        if root :
+            ck2p.parse_file(path, root, resume)
+        else :
+            ck2p.parse_file(path, resume = resume)
+    except :
+        if shards :
+            conn.close()
+            close_shards(shard_conns)
+            remove_shards(outputfile, writer)
+        raise
+    conn.close()
+    if shards :
+        close_shards(shard_conns)
+    return writer
+
+class ck2_watcher :
+    """
+        ck2_watcher polls a directory and loads every new or updated saved
+        game into outputfile.
+
+        A file is queued once its size and modification time have not
+        changed for settle seconds, so files still being written and rapid
+        rewrites of the same save are only loaded once. Loaded files are
+        recorded with their signature in the ingested_file table and are
+        skipped until they change again. A changed file replaces the rows of
+        its earlier load.
+
+        With shards, every worker writes its own shard files, and the main
+        process merges them into outputfile once the worker is done, in the
+        same transaction as the removal of the rows they replace.
+
+        directory : directory to watch
+        outputfile : path of the output database
+        workers : number of processes loading files at the same time
+        pattern : glob of the file names to load
+        interval : seconds between directory scans
+        settle : seconds a file must stay unchanged before it is loaded
+        root : root element passed to ck2_parser.parse_file
+        encode_strings, checkpoint_elements, checkpoint_seconds : passed to ck2_parser
+        shards : load through per worker shard files, see ck2_shards
+    """
+    def __init__(self, directory, outputfile, workers = 1, pattern = "*.ck2", interval = 2.0, settle = 5.0, root = None,
+            encode_strings = False, checkpoint_elements = 0, checkpoint_seconds = 0, shards = False) :
+        self.directory = directory
+        self.outputfile = outputfile
+        self.workers = max(1, workers)
+        self.pattern = pattern
+        self.interval = interval
+        self.settle = settle
+        self.root = root
+        self.encode_strings = encode_strings
+        self.checkpoint_elements = checkpoint_elements
+        self.checkpoint_seconds = checkpoint_seconds
+        self.shards = shards
+
+        # path -> (signature, time the signature was first seen)
+        self.observed = {}
+        # path -> (signature, AsyncResult)
+        self.running = {}
+        # path -> signature of files that failed to load
+        self.failed = {}
+
+        self.conn = sqlite3.connect(outputfile, timeout = DB_TIMEOUT)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS ingested_file (path, size, mtime, ingested_at)")
+        self.conn.commit()
+        self.ingested = {}
+        for path, size, mtime in self.conn.execute("SELECT path, size, mtime FROM ingested_file") :
+            self.ingested[path] = (size, mtime)
+
+        self.pool = None
+
+    def scan(self) :
+        """ Returns the paths that are fully written and not loaded yet. """
+        now = time.time()
+        ready = []
+        try :
+            names = os.listdir(self.directory)
+        except OSError as error :
+            print "Can't read directory %s: %s" % (self.directory, error)
+            return ready
+
+        for name in sorted(fnmatch.filter(names, self.pattern)) :
+            path = os.path.abspath(os.path.join(self.directory, name))
+            signature = file_signature(path)
+            if signature is None :
+                continue
+            previous = self.observed.get(path)
+            if previous is None or previous[0] != signature :
+                # New or rewritten file. Restart its settle time.
+                self.observed[path] = (signature, now)
+                continue
+            if now - previous[1] < self.settle :
+                continue
+            if path in self.running :
+                continue
+            if self.ingested.get(path) == signature or self.failed.get(path) == signature :
+                continue
+            ready.append((path, signature))
+        return ready
+
+    def mark_ingested(self, path, signature) :
+        self.ingested[path] = signature
+        self.conn.execute("DELETE FROM ingested_file WHERE path = ?", (path,))
+        self.conn.execute("INSERT INTO ingested_file (path, size, mtime, ingested_at) VALUES (?, ?, ?, ?)",
+            (path, signature[0], signature[1], time.strftime("%Y-%m-%d %H:%M:%S")))
+        self.conn.commit()
+
+    def collect(self) :
+        """ Records the files whose load has finished. """
+        for path in list(self.running.keys()) :
+            signature, result = self.running[path]
+            if not result.ready() :
+                continue
+            del self.running[path]
+            try :
+                writer = result.get()
+                if writer :
+                    merge_shards(self.conn, self.outputfile, writer)
+            except Exception as error :
+                print "Failed to load %s: %s" % (path, error)
+                self.failed[path] = signature
+                continue
+            print "Loaded %s" % (path)
+            self.mark_ingested(path, signature)
+
+    def poll(self) :
+        self.collect()
+        for path, signature in self.scan() :
+            print "Queue %s" % (path)
+            self.running[path] = (signature, self.pool.apply_async(ingest_file, (path, self.outputfile, self.root,
+                self.encode_strings, self.checkpoint_elements, self.checkpoint_seconds, self.shards)))
+
+    def run(self, cycles = None) :
+        """ Watches the directory until interrupted, or for a number of scan cycles. """
+        self.pool = multiprocessing.Pool(self.workers)
+        count = 0
+        try :
+            while cycles is None or count < cycles :
+                self.poll()
+                count += 1
+                time.sleep(self.interval)
+            # Wait for the files already queued
+            self.pool.close()
+            self.pool.join()
+            self.collect()
+        except KeyboardInterrupt :
+            print "Stopping watch on %s" % (self.directory)
+            self.pool.terminate()
+            self.pool.join()
+        finally :
+            self.conn.close()
@@ -21,19 +21,43 @@
 
 import sys, getopt
 import sqlite3
-from ck2_parser import ck2_parser
+
+# Modules are imported by the commands and options that use them, to
+# keep the startup of short runs fast. ck2_query_service doesn't load the
+# parser at all.
 
 def main(argv=[]):
     if not argv :
         argv = sys.argv[1:]
-    help_string = """Usage:   ck2_file_parser --input <input-file> --output <output-file> [--rewrite] [--root <root-element>]
+    help_string = """Usage:   ck2_file_parser --input <input-file> --output <output-file> [--rewrite] [--root <root-element>] [--genealogy] [--titles]
+                         [--checkpoint <elements>] [--checkpoint-seconds <seconds>] [--resume]
+                         [--generic] [--encode-strings] [--shards [--keep-shards]]
+                         [--columnar <directory>]
+                         [--watch <directory> [--workers <count>] [--settle <seconds>]]
+         ck2_file_parser --diff <old-file>,<new-file> --output <output-file> [--rewrite]
          ck2_file_parser --help"""
     inputfiles = []
     outputfile = ''
     root = None
+    genealogy = False
+    titles = False
+    watch_dir = None
+    workers = 1
+    settle = 5.0
+    checkpoint_elements = 0
+    checkpoint_seconds = 0
+    resume = False
+    diff_files = []
+    rewrite = False
+    generic = False
+    encode_strings = False
+    use_shards = False
+    keep_shards = False
+    columnar_dir = None
     
     try:
-        opts, args = getopt.gnu_getopt(argv,"hi:o:r:w",['help', 'input=', 'output=','rewrite', 'root='])
+        opts, args = getopt.gnu_getopt(argv,"hi:o:r:w",['help', 'input=', 'output=','rewrite', 'root=', 'genealogy', 'titles',
+            'watch=', 'workers=', 'settle=', 'checkpoint=', 'checkpoint-seconds=', 'resume', 'diff=', 'generic', 'encode-strings', 'shards', 'keep-shards', 'columnar='])
     except getopt.GetoptError:
         print help_string
         sys.exit(2)
@@ -51,18 +75,156 @@ def main(argv=[]):
             outputfile = arg
         elif opt in ['-r', '--root'] :
             root = arg
+        elif opt in ['--genealogy'] :
+            genealogy = True
+        elif opt in ['--titles'] :
+            titles = True
+        elif opt in ['--watch'] :
+            watch_dir = arg
+        elif opt in ['--workers'] :
+            workers = int(arg)
+        elif opt in ['--settle'] :
+            settle = float(arg)
+        elif opt in ['--checkpoint'] :
+            checkpoint_elements = int(arg)
+        elif opt in ['--checkpoint-seconds'] :
+            checkpoint_seconds = float(arg)
+        elif opt in ['--resume'] :
+            resume = True
+        elif opt in ['--diff'] :
+            diff_files = arg.split(",")
+        elif opt in ['-w', '--rewrite'] :
+            rewrite = True
+        elif opt in ['--generic'] :
+            generic = True
+        elif opt in ['--encode-strings'] :
+            encode_strings = True
+        elif opt in ['--shards'] :
+            use_shards = True
+        elif opt in ['--keep-shards'] :
+            keep_shards = True
+        elif opt in ['--columnar'] :
+            columnar_dir = arg
         
     print "inputfiles : %s" % (repr(inputfiles))
     print "outputfile : %s" % (repr(outputfile))
 
     conn = sqlite3.connect(outputfile)
-    ck2p = ck2_parser(conn, False)
+    
+    if diff_files :
+        if len(diff_files) != 2 :
+            print help_string
+            sys.exit(2)
+        from ck2_parser.ck2_diff import ck2_diff
+        ck2_diff(conn, rewrite).diff_files(diff_files[0], diff_files[1])
+        return
+    
+    if generic :
+        from ck2_parser.ck2_nodes import ck2_node_loader
+        loader = ck2_node_loader(conn, rewrite)
+        for file in inputfiles :
+            if root :
+                loader.load_file(file, root)
+            else :
+                loader.load_file(file)
+        return
+    
+    shards = None
+    if use_shards and (checkpoint_elements or checkpoint_seconds) :
+        print "--shards can't be used with --checkpoint"
+        sys.exit(2)
+    if keep_shards and watch_dir :
+        print "--keep-shards can't be used with --watch, the shards of every worker are merged"
+        sys.exit(2)
+    if rewrite :
+        from ck2_parser.ck2_shards import remove_all_shards
+        remove_all_shards(outputfile)
+    if use_shards :
+        from ck2_parser.ck2_shards import new_writer_id, open_shards, close_shards, merge_shards, fold_shards, attach_shards
+        # Shard files of this process only, other loads into the same output have their own
+        writer = new_writer_id()
+        shards = open_shards(outputfile, writer)
+    from ck2_parser import ck2_parser
+    ck2p = ck2_parser(conn, rewrite, checkpoint_elements, checkpoint_seconds, encode_strings, shards)
     
     for file in inputfiles :
         if root :
-            ck2p.parse_file(file, root)
+            ck2p.parse_file(file, root, resume)
         else:
-            ck2p.parse_file(file)
+            ck2p.parse_file(file, resume = resume)
+    
+    if shards :
+        close_shards(shards)
+        if keep_shards :
+            fold_shards(outputfile, writer)
+            print "Shards kept. Readers of %s must call ck2_shards.attach_shards, plain connections see empty tables" % (outputfile)
+            attach_shards(conn, outputfile)
+        else :
+            merge_shards(conn, outputfile, writer)
+    
+    if genealogy :
+        from ck2_parser.ck2_genealogy import ck2_genealogy
+        ck2_genealogy(conn).build()
+    
+    if titles :
+        from ck2_parser.ck2_titles import ck2_title_hierarchy
+        ck2_title_hierarchy(conn).build()
+    
+    if columnar_dir :
+        # numpy is optional, only needed for this export
+        from ck2_parser.ck2_columnar import export_tables
+        export_tables(conn, columnar_dir)
+    
+    if watch_dir :
+        print "watching : %s" % (repr(watch_dir))
+        from ck2_parser.ck2_watch import ck2_watcher
+        watcher = ck2_watcher(watch_dir, outputfile, workers, settle = settle, root = root, encode_strings = encode_strings,
+            checkpoint_elements = checkpoint_elements, checkpoint_seconds = checkpoint_seconds, shards = use_shards)
+        watcher.run()
+        
+def query_service(argv=[]):
+    if not argv :
+        argv = sys.argv[1:]
+    help_string = """Usage:   ck2_query_service --db <database-file> [--host <host>] [--port <port>] [--pool <connections>]
+         ck2_query_service --help"""
+    dbfile = ''
+    host = '127.0.0.1'
+    port = 8642
+    pool_size = 4
+    
+    try:
+        opts, args = getopt.gnu_getopt(argv,"hd:p:",['help', 'db=', 'host=', 'port=', 'pool='])
+    except getopt.GetoptError:
+        print help_string
+        sys.exit(2)
+    
+    for opt, arg in opts:
+        if opt in ['-h', '--help'] :
+            print help_string
+            sys.exit()
+        elif opt in ['-d','--db'] :
+            dbfile = arg
+        elif opt in ['--host'] :
+            host = arg
+        elif opt in ['-p','--port'] :
+            port = int(arg)
+        elif opt in ['--pool'] :
+            pool_size = int(arg)
+    
+    if not dbfile :
+        print help_string
+        sys.exit(2)
+    
+    from ck2_parser.ck2_service import ck2_query_service, query_server
+    service = ck2_query_service(dbfile, pool_size)
+    server = query_server(service, host, port)
+    print "serving %s on http://%s:%i/" % (dbfile, host, port)
+    try :
+        server.serve_forever()
+    except KeyboardInterrupt :
+        pass
+    server.server_close()
+    service.close()
         
 if __name__ == "__main__":
    main(sys.argv[1:])    
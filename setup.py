@@ -10,8 +10,13 @@ setup(
     license='GPL',
     packages=['ck2_parser'],
     entry_points={ 
-        'console_scripts' : ['ck2_file_parser=ck2_parser.command_line:main']
+        'console_scripts' : [
+            'ck2_file_parser=ck2_parser.command_line:main',
+            'ck2_query_service=ck2_parser.command_line:query_service']
     },
     install_requires=['sqlite3'],
+    extras_require={
+        'analytics' : ['numpy']
+    },
     zip_safe=False
 )
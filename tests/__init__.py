@@ -0,0 +1,21 @@
+# Helpers shared by the tests. Run them with: python -m unittest discover -s tests -t .
+
+import os
+import sys
+import contextlib
+from StringIO import StringIO
+
+data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+def data_path(name) :
+    return os.path.join(data_directory, name)
+
+@contextlib.contextmanager
+def quiet() :
+    # The parser prints every element it reads
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try :
+        yield
+    finally :
+        sys.stdout = stdout
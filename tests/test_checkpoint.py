@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# Tests for the checkpoints of ck2_parser. Run with: python -m unittest discover -s tests -t .
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from tests import data_path, quiet
+from ck2_parser import ck2_parser
+
+tables = ['character', 'dynasty', 'province', 'title', 'claim']
+
+class crash(Exception) :
+    pass
+
+class crashing_parser(ck2_parser) :
+    # Stops reading at crash_line, like a killed process
+    def __init__(self, dbconn, crash_line, **options) :
+        ck2_parser.__init__(self, dbconn, **options)
+        self.crash_line = crash_line
+
+    def process_line(self, line) :
+        if self.line_count + 1 == self.crash_line :
+            raise crash()
+        ck2_parser.process_line(self, line)
+
+def get_rows(conn) :
+    return dict((table_name, sorted(conn.execute("SELECT * FROM %s" % (table_name)).fetchall())) for table_name in tables)
+
+class checkpoint_test(unittest.TestCase) :
+    def setUp(self) :
+        self.directory = tempfile.mkdtemp()
+        self.save = os.path.join(self.directory, "save.ck2")
+        shutil.copy(data_path("save_1066.ck2"), self.save)
+
+    def tearDown(self) :
+        shutil.rmtree(self.directory)
+
+    def load(self, name, resume = False, crash_line = None) :
+        conn = sqlite3.connect(os.path.join(self.directory, name))
+        try :
+            with quiet() :
+                if crash_line :
+                    crashing_parser(conn, crash_line, checkpoint_elements = 3).parse_file(self.save)
+                else :
+                    ck2_parser(conn, checkpoint_elements = 3).parse_file(self.save, resume = resume)
+        finally :
+            # Closing without a commit drops the rows after the last checkpoint
+            conn.close()
+        return sqlite3.connect(os.path.join(self.directory, name))
+
+    def test_resume_matches_clean_load(self) :
+        clean = get_rows(self.load("clean.db"))
+        self.assertEqual(len(clean['character']), 6)
+        for crash_line in [3, 40, 60, 101, 126] :
+            name = "crash_%i.db" % (crash_line)
+            with self.assertRaises(crash) :
+                self.load(name, crash_line = crash_line)
+            partial = get_rows(sqlite3.connect(os.path.join(self.directory, name)))
+            self.assertNotEqual(partial, clean)
+            self.assertEqual(get_rows(self.load(name, resume = True)), clean)
+
+    def test_resume_skips_completed_file(self) :
+        conn = self.load("done.db")
+        offset, row_count, state, completed = conn.execute(
+            "SELECT byte_offset, row_count, state, completed FROM parse_checkpoint").fetchone()
+        self.assertEqual((offset, state, completed), (os.path.getsize(self.save), None, 1))
+        rows = get_rows(conn)
+        self.assertEqual(get_rows(self.load("done.db", resume = True)), rows)
+
+    def test_changed_file_is_not_resumed(self) :
+        with self.assertRaises(crash) :
+            self.load("changed.db", crash_line = 101)
+        with open(self.save, "ab") as f :
+            f.write("\n")
+        os.utime(self.save, (0, 0))
+        conn = sqlite3.connect(os.path.join(self.directory, "changed.db"))
+        self.assertIsNone(ck2_parser(conn).db.load_checkpoint(self.save))
+
+if __name__ == "__main__":
+    unittest.main()
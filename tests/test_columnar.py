@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# Tests for ck2_columnar. Run with: python -m unittest discover -s tests -t .
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from tests import quiet
+
+try :
+    import numpy as np
+    from ck2_parser.ck2_columnar import get_kind, export_table, load_table
+except ImportError :
+    np = None
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class columnar_test(unittest.TestCase) :
+    def setUp(self) :
+        self.directory = tempfile.mkdtemp()
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("CREATE TABLE sample (id INTEGER, weight REAL, amount TEXT, name TEXT, empty TEXT)")
+        self.rows = [
+            (1, 1.5, "10", "Harold", None),
+            (2, 2.0, "0.25", None, None),
+            (None, None, None, "Harold", None),
+            (4, 3, "-3", "William", None),
+        ]
+        self.conn.executemany("INSERT INTO sample VALUES (?, ?, ?, ?, ?)", self.rows)
+
+    def tearDown(self) :
+        self.conn.close()
+        shutil.rmtree(self.directory)
+
+    def export(self, batch_size = 2) :
+        with quiet() :
+            export_table(self.conn, "sample", self.directory, batch_size)
+        return load_table(self.directory, "sample")
+
+    def test_kinds(self) :
+        self.assertEqual(get_kind([1, None, 3L]), 'int')
+        self.assertEqual(get_kind([1, 2.0]), 'float')
+        self.assertEqual(get_kind([1.5, 2]), 'float')
+        self.assertEqual(get_kind(["1", "2.5"]), 'float')
+        self.assertEqual(get_kind(["7", "-3"]), 'int')
+        self.assertEqual(get_kind([1, "Harold"]), 'str')
+        self.assertEqual(get_kind([None]), 'int')
+
+    def test_round_trip(self) :
+        columns = self.export()
+        self.assertEqual(len(columns), len(self.rows))
+        self.assertEqual(columns.kinds, {'id' : 'int', 'weight' : 'float', 'amount' : 'float', 'name' : 'str', 'empty' : 'int'})
+        self.assertEqual(list(columns["id"][columns.get_mask("id")]), [1, 2, 4])
+        self.assertEqual(list(columns.get_mask("id")), [True, True, False, True])
+        self.assertEqual(list(columns["weight"][:2]), [1.5, 2.0])
+        self.assertTrue(np.isnan(columns["weight"][2]))
+        self.assertEqual(list(columns["amount"][columns.get_mask("amount")]), [10.0, 0.25, -3.0])
+        self.assertEqual(list(columns.get_strings("name")), ["Harold", None, "Harold", "William"])
+        self.assertEqual(list(columns.get_dictionary("name")), ["Harold", "William"])
+        self.assertFalse(columns.get_mask("empty").any())
+
+    def test_mask_only_with_nulls(self) :
+        self.conn.execute("DELETE FROM sample WHERE id IS NULL")
+        columns = self.export()
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "sample", "id.mask.npy")))
+        self.assertTrue(columns.get_mask("id").all())
+
+    def test_empty_table(self) :
+        self.conn.execute("DELETE FROM sample")
+        columns = self.export()
+        self.assertEqual(len(columns), 0)
+        self.assertEqual(len(columns["name"]), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+# Tests for ck2_diff. Run with: python -m unittest discover -s tests -t .
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import sqlite3
+import unittest
+
+from tests import data_path, quiet
+from ck2_parser.ck2_diff import ck2_entity_reader, ck2_diff
+
+class parse_without_db_test(unittest.TestCase) :
+    def test_entity_reader(self) :
+        reader = ck2_entity_reader()
+        with quiet() :
+            reader.parse_file(data_path("save_1066.ck2"))
+        keys = [(entity_type, entity_id) for section, entity_type, entity_id, fields in reader.entities]
+        self.assertEqual(len(keys), 15)
+        self.assertIn(("claim", "103:k_england"), keys)
+        self.assertIn(("province", "2"), keys)
+
+    def test_read_sections(self) :
+        with quiet() :
+            sections = list(ck2_entity_reader().read_sections(data_path("save_1066.ck2")))
+        self.assertEqual([section for section, entities in sections],
+            ["dynasties", "character", "CK2_Save_game_element", "title"])
+        self.assertEqual(sections[1][1][("character", "104")]["birth_name"], "Louis")
+
+class diff_test(unittest.TestCase) :
+    def test_diff_files(self) :
+        conn = sqlite3.connect(":memory:")
+        with quiet() :
+            count = ck2_diff(conn).diff_files(data_path("save_1066.ck2"), data_path("save_1067.ck2"))
+        self.assertEqual(count, 5)
+        changes = conn.execute("""SELECT entity_type, entity_id, change, field, old_value, new_value
+            FROM save_diff ORDER BY entity_type, entity_id""").fetchall()
+        self.assertEqual(changes, [
+            ("character", "1", "changed", "death_date", "950.1.1", None),
+            ("character", "105", "added", None, None, None),
+            ("claim", "103:k_england", "removed", None, None, None),
+            ("claim", "103:k_scotland", "added", None, None, None),
+            ("title", "d_normandy", "changed", "holder", "104", "103"),
+        ])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# Tests for the encode_strings layout of ck2_db. Run with: python -m unittest discover -s tests -t .
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from tests import data_path, quiet
+from ck2_parser import ck2_parser
+from ck2_parser.ck2_file_parser import encoded_fields
+
+class encode_strings_test(unittest.TestCase) :
+    def setUp(self) :
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) :
+        shutil.rmtree(self.directory)
+
+    def load(self, name, save, **options) :
+        conn = sqlite3.connect(os.path.join(self.directory, name))
+        with quiet() :
+            parser = ck2_parser(conn, **options)
+            parser.parse_file(data_path(save))
+        self.fields = parser.db.fields
+        return conn
+
+    def get_rows(self, conn, table_name) :
+        sql = "SELECT %s FROM %s" % (", ".join(self.fields[table_name]), table_name)
+        return sorted(conn.execute(sql).fetchall())
+
+    def get_type(self, conn, name) :
+        row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def test_views_match_plain_load(self) :
+        plain = self.load("plain.db", "save_1066.ck2")
+        encoded = self.load("encoded.db", "save_1066.ck2", encode_strings = True)
+        for table_name in encoded_fields.keys() :
+            self.assertEqual(self.get_type(encoded, table_name), 'view')
+            self.assertEqual(self.get_rows(encoded, table_name), self.get_rows(plain, table_name), table_name)
+        self.assertEqual(sorted(encoded.execute("SELECT * FROM live_dynasts").fetchall()),
+            sorted(plain.execute("SELECT * FROM live_dynasts").fetchall()))
+
+    def test_lookup_ids_are_reused(self) :
+        conn = self.load("encoded.db", "save_1066.ck2", encode_strings = True)
+        before = conn.execute("SELECT id, name FROM culture_lookup ORDER BY id").fetchall()
+        self.load("encoded.db", "save_1067.ck2", encode_strings = True)
+        after = conn.execute("SELECT id, name FROM culture_lookup ORDER BY id").fetchall()
+        self.assertEqual(after[:len(before)], before)
+        self.assertEqual(len(after), len(set(name for id, name in after)))
+        # Both loads store a culture with the same id
+        shared = conn.execute("""SELECT culture FROM character_data WHERE culture IS NOT NULL
+            GROUP BY culture HAVING count(DISTINCT source_id) = 2""").fetchall()
+        self.assertNotEqual(shared, [])
+
+    def test_rewrite_switches_layout(self) :
+        conn = self.load("output.db", "save_1066.ck2", encode_strings = True)
+        expected = self.get_rows(conn, "character")
+        self.load("output.db", "save_1066.ck2", drop_tables = True)
+        self.assertEqual(self.get_type(conn, "character"), 'table')
+        self.assertEqual(self.get_type(conn, "character_data"), None)
+        self.assertEqual(self.get_type(conn, "culture_lookup"), None)
+        self.assertEqual(self.get_rows(conn, "character"), expected)
+        self.load("output.db", "save_1066.ck2", drop_tables = True, encode_strings = True)
+        self.assertEqual(self.get_type(conn, "character"), 'view')
+        self.assertEqual(self.get_type(conn, "character_data"), 'table')
+        self.assertEqual(self.get_rows(conn, "character"), expected)
+
+    def test_layout_mismatch(self) :
+        self.load("plain.db", "save_1066.ck2")
+        with self.assertRaisesRegexp(Exception, "holds text columns") :
+            self.load("plain.db", "save_1066.ck2", encode_strings = True)
+        self.load("encoded.db", "save_1066.ck2", encode_strings = True)
+        with self.assertRaisesRegexp(Exception, "holds encoded strings") :
+            self.load("encoded.db", "save_1066.ck2")
+
+if __name__ == "__main__":
+    unittest.main()
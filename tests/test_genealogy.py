@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# Tests for ck2_genealogy. Run with: python -m unittest discover -s tests -t .
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import types
+import sqlite3
+import unittest
+
+from tests import quiet
+from ck2_parser.ck2_genealogy import ck2_genealogy
+
+# (id, father, mother)
+# 1 x 2 have 3 and 4, who marry each other and have 5. 3 also has 7 with 6.
+# 10 x 11 have 12 and 13, whose children 16 and 17 are first cousins.
+characters = [
+    (1, None, None), (2, None, None), (3, 1, 2), (4, 1, 2), (5, 3, 4), (6, None, None), (7, 3, 6),
+    (10, None, None), (11, None, None), (12, 10, 11), (13, 10, 11), (14, None, None), (15, None, None),
+    (16, 12, 14), (17, 15, 13),
+]
+
+class genealogy_test(unittest.TestCase) :
+    def setUp(self) :
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("CREATE TABLE character_view (id INTEGER, father INTEGER, mother INTEGER)")
+        self.conn.executemany("INSERT INTO character_view VALUES (?, ?, ?)", characters)
+        self.genealogy = ck2_genealogy(self.conn)
+        with quiet() :
+            self.genealogy.build()
+
+    def tearDown(self) :
+        self.conn.close()
+
+    def test_ancestors_count_paths(self) :
+        # 5 reaches each grandparent through both of its parents
+        self.assertEqual(self.genealogy.get_ancestors(5), [(3, 1, 1), (4, 1, 1), (1, 2, 2), (2, 2, 2)])
+        self.assertEqual(self.genealogy.get_descendants(1, 1), [(3, 1, 1), (4, 1, 1)])
+        self.assertTrue(self.genealogy.is_ancestor(1, 7))
+        self.assertFalse(self.genealogy.is_ancestor(4, 7))
+
+    def test_common_ancestors(self) :
+        self.assertEqual(self.genealogy.get_common_ancestors(16, 17), [(10, 2, 2), (11, 2, 2)])
+        self.assertEqual(self.genealogy.get_common_ancestors(5, 3)[0], (3, 1, 0))
+
+    def test_relationship_coefficient(self) :
+        r = self.genealogy.get_relationship_coefficient
+        self.assertAlmostEqual(r(12, 13), 0.5)
+        self.assertAlmostEqual(r(16, 17), 0.125)
+        self.assertAlmostEqual(r(12, 16), 0.5)
+        self.assertAlmostEqual(r(10, 16), 0.25)
+        self.assertAlmostEqual(r(16, 14), 0.5)
+        self.assertAlmostEqual(r(14, 15), 0.0)
+
+    def test_pedigree_collapse(self) :
+        r = self.genealogy.get_relationship_coefficient
+        # Directly, and again through each grandparent by way of the other parent
+        self.assertAlmostEqual(r(5, 3), 0.75)
+        self.assertAlmostEqual(r(5, 4), 0.75)
+        # Half siblings through 3, plus the lines through 1 and 2
+        self.assertAlmostEqual(r(5, 7), 0.375)
+        self.assertAlmostEqual(r(7, 5), 0.375)
+        self.assertAlmostEqual(r(3, 4), 0.5)
+
+    def test_submodule_import(self) :
+        # The package must not hide the module behind the class of the same name
+        import ck2_parser.ck2_genealogy as genealogy
+        self.assertIsInstance(genealogy, types.ModuleType)
+        self.assertIs(genealogy.ck2_genealogy, ck2_genealogy)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# Tests for ck2_graph. Run with: python -m unittest discover -s tests -t .
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+try :
+    import numpy as np
+    from ck2_parser.ck2_graph import ck2_graph, csr_from_edges, csr_expand
+except ImportError :
+    np = None
+
+# id, father, mother, spouse, betrothal, dynasty, host, employer, female, birth_date, death_date, player
+rows = [
+    (1, None, None, "2", None, 100, 1, None, None, "1000-01-01", "1060-01-01", None),
+    (2, None, None, "1", None, 200, 1, None, "yes", "1002-01-01", "1070-01-01", None),
+    (3, 1, 2, "4", None, 100, 3, None, None, "1030-01-01", None, "yes"),
+    (4, 1, 2, "3", None, 100, 3, None, "yes", "1028-01-01", None, None),
+    (5, 3, 4, None, None, 100, 3, None, "yes", "1050-05-01", None, None),
+    (6, None, None, None, None, 300, 3, 3, "yes", "1031-01-01", None, None),
+    (7, 3, 6, None, "9", 100, 3, None, None, "1052-01-01", None, None),
+    (8, 3, 6, None, None, 100, 3, None, None, "1050-01-01", None, None),
+    (9, None, None, None, "7", 400, 9, None, "yes", "1055-01-01", None, None),
+]
+
+@unittest.skipIf(np is None, "needs numpy")
+class graph_test(unittest.TestCase) :
+    def setUp(self) :
+        self.graph = ck2_graph(rows)
+
+    def assertIds(self, result, expected) :
+        self.assertEqual(sorted(int(x) for x in result), sorted(expected))
+
+    def test_csr(self) :
+        indptr, indices = csr_from_edges(np.array([2, 0, 2, 1]), np.array([5, 6, 7, 8]), 4)
+        self.assertEqual(list(indptr), [0, 1, 2, 4, 4])
+        self.assertEqual(list(csr_expand(indptr, indices, np.array([2, 0]))), [5, 7, 6])
+        self.assertEqual(len(csr_expand(indptr, indices, np.array([3]))), 0)
+
+    def test_index_of(self) :
+        self.assertEqual(list(self.graph.index_of([5, 42, 1])), [4, -1, 0])
+        self.assertIds(self.graph.to_ids(self.graph.index_of([5, 42])), [5])
+
+    def test_traversals(self) :
+        self.assertIds(self.graph.ancestors([5]), [1, 2, 3, 4])
+        self.assertIds(self.graph.ancestors([7], max_depth = 1), [3, 6])
+        self.assertIds(self.graph.descendants([1]), [3, 4, 5, 7, 8])
+        self.assertIds(self.graph.descendants([6, 4]), [5, 7, 8])
+        self.assertIds(self.graph.descendants([42]), [])
+
+    def test_filters(self) :
+        self.assertIds(self.graph.living_dynasts(), [3, 4, 5, 7, 8])
+        self.assertIds(self.graph.single_dynasts(), [5, 8])
+        self.assertIds(self.graph.court(3), [3, 4, 5, 6, 7, 8])
+
+    def test_heirs(self) :
+        # Sons by birth date, then daughters
+        self.assertEqual(list(self.graph.heirs(3, 1)), [8, 7, 5])
+        self.assertEqual(list(self.graph.heirs(3, 1, male_first = False)), [8, 5, 7])
+        self.assertEqual(list(self.graph.heirs(1)), [3, 4, 8, 7, 5])
+
+    def test_shared_ancestry(self) :
+        self.assertIds(self.graph.inbreeding_risk(), [5])
+        self.assertEqual(list(self.graph.marriage_risk(5, [7, 9, 1])), [True, False, True])
+
+if __name__ == "__main__":
+    unittest.main()
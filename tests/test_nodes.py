@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# Tests for ck2_nodes. Run with: python -m unittest discover -s tests -t .
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from tests import data_path, quiet
+from ck2_parser.ck2_nodes import ck2_node_loader, split_statements
+
+def count_nodes(conn) :
+    return conn.execute("SELECT count(*), count(DISTINCT id) FROM node").fetchone()
+
+class node_loader_test(unittest.TestCase) :
+    def setUp(self) :
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, "nodes.db")
+
+    def tearDown(self) :
+        shutil.rmtree(self.directory)
+
+    def load(self, conn, path) :
+        with quiet() :
+            ck2_node_loader(conn).parse_file(path)
+
+    def test_parse_file(self) :
+        conn = sqlite3.connect(self.output)
+        self.load(conn, data_path("save_1066.ck2"))
+        self.assertEqual(count_nodes(conn), (114, 114))
+        names = conn.execute("SELECT value FROM node_view WHERE key = 'birth_name' ORDER BY id").fetchall()
+        self.assertEqual([name for (name,) in names], ["Hugues", "Adela", "Robert", "Emma", "Philip", "Louis"])
+
+    def test_split_statements(self) :
+        self.assertEqual(split_statements("b = { x = 1 y = 2 }"), ["b = {", "x = 1", "y = 2", "}"])
+        self.assertEqual(split_statements('a = { n = "Le Roi" l = { 1 2 } } # c = 3'),
+            ["a = {", 'n = "Le Roi"', "l = {", "1 2 }", "}"])
+        self.assertEqual(split_statements("traits = { 1 2 }"), [])
+        self.assertEqual(split_statements("name = \"a = b\""), [])
+
+    def test_pairs_on_one_line(self) :
+        path = os.path.join(self.directory, "pairs.txt")
+        with open(path, "w") as f :
+            f.write("b = { x = 1 y = 2 }\nc = { d = { e = 3 } d = 4 }\nz = 5\n")
+        conn = sqlite3.connect(self.output)
+        self.load(conn, path)
+        rows = conn.execute("""SELECT p.key, n.key, n.value, n.position FROM node_view n
+            JOIN node_view p ON p.id = n.parent_id ORDER BY n.parent_id, n.position""").fetchall()
+        self.assertEqual(sorted(rows), sorted([
+            ("CK2_Save_game", "b", None, 0), ("CK2_Save_game", "c", None, 1), ("CK2_Save_game", "z", "5", 2),
+            ("b", "x", "1", 0), ("b", "y", "2", 1),
+            ("c", "d", None, 0), ("c", "d", "4", 1), ("d", "e", "3", 0),
+        ]))
+
+    def test_loaders_share_a_database(self) :
+        # Both loaders exist before either writes a node
+        first = ck2_node_loader(sqlite3.connect(self.output))
+        second = ck2_node_loader(sqlite3.connect(self.output))
+        with quiet() :
+            first.parse_file(data_path("save_1066.ck2"))
+            second.parse_file(data_path("save_1067.ck2"))
+        conn = sqlite3.connect(self.output)
+        total = count_nodes(conn)[0]
+        self.assertEqual(count_nodes(conn), (total, total))
+        self.assertEqual(conn.execute("SELECT count(*) FROM node_key").fetchone()[0],
+            conn.execute("SELECT count(DISTINCT name) FROM node_key").fetchone()[0])
+        roots = conn.execute("SELECT root_id FROM node_file ORDER BY root_id").fetchall()
+        self.assertEqual(conn.execute("SELECT count(*) FROM node WHERE parent_id IS NULL").fetchone()[0], 2)
+        self.assertEqual(conn.execute("SELECT id FROM node WHERE parent_id IS NULL ORDER BY id").fetchall(), roots)
+
+    def test_reload_replaces_tree(self) :
+        path = os.path.join(self.directory, "save.ck2")
+        shutil.copy(data_path("save_1066.ck2"), path)
+        conn = sqlite3.connect(self.output)
+        self.load(conn, path)
+        self.load(conn, path)
+        self.assertEqual(count_nodes(conn), (114, 114))
+        self.assertEqual(conn.execute("SELECT count(*) FROM node_file").fetchone()[0], 1)
+
+if __name__ == "__main__":
+    unittest.main()
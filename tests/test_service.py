@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+# Tests for ck2_service. Run with: python -m unittest discover -s tests -t .
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import shutil
+import sqlite3
+import urllib2
+import tempfile
+import threading
+import unittest
+
+from tests import data_path, quiet
+from ck2_parser import ck2_parser
+from ck2_parser import ck2_service
+from ck2_parser.ck2_service import ck2_query_service, query_error, query_server
+from ck2_parser.command_line import main
+
+class service_test(unittest.TestCase) :
+    def setUp(self) :
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, "output.db")
+        self.load("save_1066.ck2")
+        self.service = ck2_query_service(self.output, pool_size = 2)
+
+    def tearDown(self) :
+        self.service.close()
+        shutil.rmtree(self.directory)
+
+    def load(self, name) :
+        conn = sqlite3.connect(self.output)
+        with quiet() :
+            ck2_parser(conn).parse_file(data_path(name))
+        conn.close()
+
+    def count_rows(self, view) :
+        conn = sqlite3.connect(self.output)
+        count = conn.execute("SELECT count(*) FROM %s" % (view)).fetchone()[0]
+        conn.close()
+        return count
+
+    def test_cache_is_cleared_by_a_commit(self) :
+        count = self.count_rows('live_dynasts')
+        columns, rows, cached = self.service.run_query('live_dynasts')
+        self.assertEqual((len(rows), cached), (count, False))
+        columns, rows, cached = self.service.run_query('live_dynasts')
+        self.assertEqual((len(rows), cached), (count, True))
+        self.assertEqual(self.service.run_query('live_dynasts', {'status' : 'ruler'})[2], False)
+
+        # Another connection commits a new save, with more living dynasts
+        self.load("save_1067.ck2")
+        self.assertGreater(self.count_rows('live_dynasts'), count)
+        columns, rows, cached = self.service.run_query('live_dynasts')
+        self.assertEqual((len(rows), cached), (self.count_rows('live_dynasts'), False))
+        self.assertEqual(self.service.run_query('live_dynasts')[2], True)
+
+    def test_errors(self) :
+        self.assertRaises(query_error, self.service.run_query, 'unknown')
+        self.assertRaises(query_error, self.service.run_query, 'character')
+        self.assertRaises(query_error, self.service.run_query, 'dynasty', {'name' : 'Capet'})
+        self.assertRaises(sqlite3.OperationalError, self.service.pool.get()[0].execute, "DELETE FROM character")
+
+    def test_commit_during_a_query(self) :
+        conn = sqlite3.connect(self.output)
+        # Readers don't block the writer, so it can commit while the query runs
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("CREATE TABLE probe (value)")
+        conn.commit()
+        commits = [1]
+        def commit_elsewhere() :
+            if commits :
+                commits.pop()
+                conn.execute("INSERT INTO probe VALUES (1)")
+                conn.commit()
+            return 1
+        connections = [self.service.pool.get() for i in range(self.service.pool.qsize())]
+        for pooled, version in connections :
+            pooled.create_function("commit_elsewhere", 0, commit_elsewhere)
+            self.service.pool.put((pooled, version))
+        ck2_service.queries['probe'] = {'sql' : "SELECT commit_elsewhere()", 'params' : []}
+        try :
+            # The first result was read before the commit, so it isn't kept
+            self.assertEqual(self.service.run_query('probe')[2], False)
+            self.assertEqual(self.service.run_query('probe')[2], False)
+            self.assertEqual(self.service.run_query('probe')[2], True)
+        finally :
+            del ck2_service.queries['probe']
+            conn.close()
+
+    def test_kept_shards_loaded_while_serving(self) :
+        self.assertEqual(len(self.service.run_query('dynasty')[1]), 2)
+        # The save is loaded again into shards while the service runs. Its
+        # connections must attach them to see the new rows.
+        with quiet() :
+            main(["-i", data_path("save_1066.ck2"), "-o", self.output, "--shards", "--keep-shards"])
+        self.assertEqual(self.count_rows('dynasty'), 0)
+        columns, rows, cached = self.service.run_query('dynasty')
+        self.assertEqual((len(rows), cached), (2, False))
+        self.assertEqual(len(self.service.run_query('character', {'id' : '103'})[1]), 1)
+        self.assertEqual(len(self.service.run_query('character', {'id' : '104'})[1]), 1)
+
+    def test_http(self) :
+        server = query_server(self.service, port = 0)
+        thread = threading.Thread(target = server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try :
+            url = "http://127.0.0.1:%i/query/dynasty?culture=saxon" % (server.server_address[1])
+            content = json.load(urllib2.urlopen(url))
+            self.assertEqual(content['rows'], [["200", "Godwin", "saxon"]])
+        finally :
+            server.shutdown()
+            server.server_close()
+
+if __name__ == "__main__":
+    unittest.main()
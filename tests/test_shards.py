@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+# Tests for ck2_shards. Run with: python -m unittest discover -s tests -t .
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from tests import data_path, quiet
+from ck2_parser import ck2_parser
+from ck2_parser.ck2_shards import new_writer_id, open_shards, close_shards, merge_shards, fold_shards, attach_shards, find_shard_paths
+from ck2_parser.command_line import main
+from ck2_parser.ck2_service import ck2_query_service
+from ck2_parser.ck2_watch import ck2_watcher
+
+def count_characters(conn) :
+    return conn.execute("SELECT count(*) FROM character").fetchone()[0]
+
+class shards_test(unittest.TestCase) :
+    def setUp(self) :
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, "output.db")
+        self.saves = os.path.join(self.directory, "saves")
+        os.mkdir(self.saves)
+        for name in ["save_1066.ck2", "save_1067.ck2"] :
+            shutil.copy(data_path(name), self.saves)
+
+    def tearDown(self) :
+        shutil.rmtree(self.directory)
+
+    def save_path(self, name) :
+        return os.path.join(self.saves, name)
+
+    def start_writer(self, encode_strings = False) :
+        # Like ck2_file_parser --shards: main tables in the output, the rest in the writer shards
+        conn = sqlite3.connect(self.output, timeout = 60)
+        writer = new_writer_id()
+        shards = open_shards(self.output, writer)
+        with quiet() :
+            parser = ck2_parser(conn, False, encode_strings = encode_strings, shards = shards)
+        return conn, writer, shards, parser
+
+    def load(self, parser, name) :
+        with quiet() :
+            parser.parse_file(self.save_path(name))
+
+    def run_main(self, name, *options) :
+        with quiet() :
+            main(["-i", self.save_path(name), "-o", self.output] + list(options))
+
+    def count_attached(self) :
+        conn = sqlite3.connect(self.output)
+        attach_shards(conn, self.output)
+        return count_characters(conn)
+
+    def test_writers_have_their_own_shards(self) :
+        conn1, writer1, shards1, parser1 = self.start_writer()
+        conn2, writer2, shards2, parser2 = self.start_writer()
+        self.assertNotEqual(writer1, writer2)
+        self.load(parser1, "save_1066.ck2")
+        self.load(parser2, "save_1067.ck2")
+        close_shards(shards1)
+        close_shards(shards2)
+
+        with quiet() :
+            merge_shards(conn1, self.output, writer1)
+        # The shards of the other writer are still there
+        self.assertEqual(len(find_shard_paths(self.output)['character']), 1)
+        self.assertEqual(count_characters(conn1), 6)
+        with quiet() :
+            merge_shards(conn2, self.output, writer2)
+        self.assertEqual(find_shard_paths(self.output), {})
+        self.assertEqual(count_characters(conn1), 13)
+
+    def test_kept_shards(self) :
+        conn, writer, shards, parser = self.start_writer(encode_strings = True)
+        self.load(parser, "save_1066.ck2")
+        close_shards(shards)
+        conn.close()
+        with quiet() :
+            fold_shards(self.output, writer)
+
+        self.assertEqual(count_characters(sqlite3.connect(self.output)), 0)
+        conn = sqlite3.connect(self.output)
+        attach_shards(conn, self.output)
+        self.assertEqual(count_characters(conn), 6)
+        self.assertEqual(conn.execute("SELECT count(*) FROM character_view WHERE culture = 'frankish'").fetchone()[0], 5)
+        conn.close()
+
+        service = ck2_query_service(self.output, pool_size = 2)
+        columns, rows, cached = service.run_query('character', {'id' : '103'})
+        self.assertEqual(rows[0][columns.index('name')], "Philip")
+        service.close()
+
+        # Loading the same file again leaves out the rows kept by the first writer
+        conn, writer, shards, parser = self.start_writer(encode_strings = True)
+        self.load(parser, "save_1066.ck2")
+        close_shards(shards)
+        attach_shards(conn, self.output)
+        self.assertEqual(count_characters(conn), 6)
+
+    def test_many_kept_writers(self) :
+        for name in ["save_1066.ck2", "save_1067.ck2", "save_1066.ck2", "save_1067.ck2"] :
+            self.run_main(name, "--shards", "--keep-shards")
+        # One kept file per group, with the rows of the last load of every file
+        self.assertEqual(sorted(len(paths) for paths in find_shard_paths(self.output).values()), [1, 1, 1, 1])
+        self.assertEqual(self.count_attached(), 13)
+        kept = sqlite3.connect(find_shard_paths(self.output)['character'][0])
+        self.assertEqual(count_characters(kept), 13)
+
+        service = ck2_query_service(self.output, pool_size = 2)
+        columns, rows, cached = service.run_query('character', {'id' : '103'})
+        # 103 is in both saves
+        self.assertEqual(len(rows), 2)
+        service.close()
+
+    def test_too_many_shard_files(self) :
+        for i in range(3) :
+            conn, writer, shards, parser = self.start_writer()
+            close_shards(shards)
+        with self.assertRaisesRegexp(Exception, "more shard files than SQLite can attach") :
+            attach_shards(sqlite3.connect(self.output), self.output)
+
+    def test_rewrite_removes_kept_shards(self) :
+        self.run_main("save_1066.ck2", "--shards", "--keep-shards")
+        self.run_main("save_1067.ck2", "--rewrite")
+        self.assertEqual(find_shard_paths(self.output), {})
+        self.assertEqual(self.count_attached(), 7)
+
+    def test_rewrite_keeps_source_ids(self) :
+        # Kept shards left by a rewrite that doesn't delete them are not read
+        self.run_main("save_1066.ck2", "--shards", "--keep-shards")
+        with quiet() :
+            ck2_parser(sqlite3.connect(self.output), True).parse_file(self.save_path("save_1067.ck2"))
+        self.assertEqual(len(find_shard_paths(self.output)), 4)
+        self.assertEqual(self.count_attached(), 7)
+
+    def test_watch_with_shards(self) :
+        with quiet() :
+            ck2_parser(sqlite3.connect(self.output), True, encode_strings = True)
+        watcher = ck2_watcher(self.saves, self.output, workers = 2, interval = 0.05, settle = 0,
+            encode_strings = True, shards = True)
+        with quiet() :
+            watcher.run(cycles = 3)
+        self.assertEqual(watcher.failed, {})
+        self.assertEqual(sorted(os.listdir(self.directory)), ["output.db", "saves"])
+
+        conn = sqlite3.connect(self.output)
+        self.assertEqual(count_characters(conn), 13)
+        self.assertEqual(conn.execute("SELECT count(*) FROM culture_lookup").fetchone()[0], 3)
+        self.assertEqual(conn.execute("""SELECT culture, count(*) FROM character_view
+            GROUP BY culture ORDER BY culture""").fetchall(), [(None, 1), ("frankish", 10), ("saxon", 2)])
+
+        # A rewritten save replaces its rows when its worker's shards are merged
+        shutil.copy(data_path("save_1067.ck2"), self.save_path("save_1066.ck2"))
+        os.utime(self.save_path("save_1066.ck2"), (0, 0))
+        watcher = ck2_watcher(self.saves, self.output, interval = 0.05, settle = 0, encode_strings = True, shards = True)
+        with quiet() :
+            watcher.run(cycles = 3)
+        self.assertEqual(count_characters(conn), 14)
+        self.assertEqual(conn.execute("SELECT count(*) FROM source_file").fetchone()[0], 2)
+        self.assertEqual(conn.execute("SELECT count(DISTINCT source_id) FROM character_data").fetchone()[0], 2)
+
+if __name__ == "__main__":
+    unittest.main()
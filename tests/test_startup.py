@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# Tests for the lazy imports and the schema version check. Run with: python -m unittest discover -s tests -t .
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import subprocess
+
+from tests import quiet
+from ck2_parser import ck2_parser
+from ck2_parser.ck2_file_parser import SCHEMA_VERSION
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ddl = re.compile(r"^\s*(CREATE|DROP|ALTER)\s|^\s*PRAGMA\s+user_version\s*=", re.IGNORECASE)
+
+class recording_cursor :
+    def __init__(self, wrapped, statements) :
+        self.wrapped = wrapped
+        self.statements = statements
+
+    def execute(self, sql, *args) :
+        self.statements.append(sql)
+        return self.wrapped.execute(sql, *args)
+
+    def executemany(self, sql, *args) :
+        self.statements.append(sql)
+        return self.wrapped.executemany(sql, *args)
+
+    def __getattr__(self, name) :
+        return getattr(self.wrapped, name)
+
+class recording_connection(recording_cursor) :
+    # Records the statements run by ck2_db, on the connection and its cursors
+    def cursor(self) :
+        return recording_cursor(self.wrapped.cursor(), self.statements)
+
+class startup_test(unittest.TestCase) :
+    def setUp(self) :
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, "output.db")
+
+    def tearDown(self) :
+        shutil.rmtree(self.directory)
+
+    def open_db(self, **options) :
+        # Returns the statements run by ck2_db on the output database
+        statements = []
+        conn = sqlite3.connect(self.output)
+        with quiet() :
+            ck2_parser(recording_connection(conn, statements), **options)
+        conn.close()
+        return [sql for sql in statements if ddl.match(sql)]
+
+    def get_version(self) :
+        return sqlite3.connect(self.output).execute("PRAGMA user_version").fetchone()[0]
+
+    def test_command_line_doesnt_import_the_parser(self) :
+        code = "import sys, ck2_parser.command_line; print 'ck2_parser.ck2_file_parser' in sys.modules"
+        output = subprocess.check_output([sys.executable, "-c", code], cwd = repo)
+        self.assertEqual(output.strip(), "False")
+
+    def test_current_schema_runs_no_ddl(self) :
+        self.assertNotEqual(self.open_db(), [])
+        self.assertEqual(self.get_version(), SCHEMA_VERSION * 2)
+        self.assertEqual(self.open_db(), [])
+
+        # An older version runs the whole schema creation again
+        sqlite3.connect(self.output).execute("PRAGMA user_version = %i" % ((SCHEMA_VERSION - 1) * 2))
+        self.assertNotEqual(self.open_db(), [])
+        self.assertEqual(self.get_version(), SCHEMA_VERSION * 2)
+
+    def test_mode_change_runs_full_init(self) :
+        self.open_db(encode_strings = True)
+        self.assertEqual(self.get_version(), SCHEMA_VERSION * 2 + 1)
+        self.assertEqual(self.open_db(encode_strings = True), [])
+        # The plain layout doesn't match the stamp, so the tables are checked
+        # and the encoded ones refused
+        with self.assertRaisesRegexp(Exception, "holds encoded strings") :
+            self.open_db()
+        self.assertNotEqual(self.open_db(drop_tables = True), [])
+        self.assertEqual(self.get_version(), SCHEMA_VERSION * 2)
+        self.assertEqual(self.open_db(), [])
+
+if __name__ == "__main__":
+    unittest.main()
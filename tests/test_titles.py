@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+# Tests for ck2_titles. Run with: python -m unittest discover -s tests -t .
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import sqlite3
+import unittest
+
+from tests import quiet
+from ck2_parser.ck2_titles import ck2_title_hierarchy
+
+# (title_id, de_jure_liege)
+landed_titles = [
+    ("k_england", "e_britannia"), ("d_wessex", "k_england"), ("d_kent", "k_england"),
+    ("c_dorset", "d_wessex"), ("c_hampshire", "d_wessex"), ("c_kent", "d_kent"),
+    ("b_winchester", "c_hampshire"),
+]
+
+# (id, liege): Kent broke away
+titles = [
+    ("d_wessex", "k_england"), ("c_dorset", "d_wessex"), ("c_hampshire", "d_wessex"),
+    ("c_kent", "d_kent"), ("b_winchester", "c_hampshire"),
+]
+
+class title_hierarchy_test(unittest.TestCase) :
+    def setUp(self) :
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("CREATE TABLE landed_title (title_id, de_jure_liege)")
+        self.conn.execute("CREATE TABLE title (id, liege)")
+        self.conn.executemany("INSERT INTO landed_title VALUES (?, ?)", landed_titles)
+        self.conn.executemany("INSERT INTO title VALUES (?, ?)", titles)
+        self.titles = ck2_title_hierarchy(self.conn)
+        with quiet() :
+            self.titles.build()
+
+    def tearDown(self) :
+        self.conn.close()
+
+    def test_vassals(self) :
+        self.assertEqual(self.titles.get_vassals("d_wessex"),
+            [("c_dorset", 1), ("c_hampshire", 1), ("b_winchester", 2)])
+        self.assertEqual(self.titles.get_vassals("k_england", de_jure = True, tier = "c"),
+            [("c_dorset", 2), ("c_hampshire", 2), ("c_kent", 2)])
+        self.assertEqual(self.titles.get_vassals("k_england", de_jure = True, max_depth = 1),
+            [("d_kent", 1), ("d_wessex", 1)])
+
+    def test_lieges(self) :
+        self.assertEqual(self.titles.get_lieges("b_winchester"),
+            [("c_hampshire", 1), ("d_wessex", 2), ("k_england", 3)])
+        self.assertEqual(self.titles.get_top_liege("c_kent"), "d_kent")
+        self.assertEqual(self.titles.get_top_liege("c_kent", de_jure = True), "e_britannia")
+        self.assertEqual(self.titles.get_top_liege("k_england"), "k_england")
+
+    def test_realm_sizes(self) :
+        self.assertEqual(self.titles.get_realm_size("k_england"), 2)
+        self.assertEqual(self.titles.get_realm_size("k_england", de_jure = True), 3)
+        self.assertEqual(self.titles.get_realm_size("c_kent"), 1)
+        self.assertEqual(self.titles.get_realm_sizes(), [("k_england", 2), ("d_kent", 1)])
+
+    def test_cache(self) :
+        self.titles.get_lieges("c_dorset")
+        self.titles.get_lieges("c_dorset")
+        self.assertEqual(self.titles.cache.hits, 1)
+        with quiet() :
+            self.titles.build(rebuild = False)
+        self.assertEqual(len(self.titles.cache), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+# Tests for ck2_watch. Run with: python -m unittest discover -s tests -t .
+
+# Copyright (C) 2016  Jamil Navarro <jamilnavarro@gmail.com>
+
+# This file is part of CK2_Parser.
+
+# CK2_Parser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CK2_Parser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with CK2_Parser.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from tests import data_path, quiet
+from ck2_parser import ck2_parser
+from ck2_parser.ck2_watch import ingest_file, ck2_watcher
+
+def count_rows(conn, table_name = "character") :
+    return conn.execute("SELECT count(*), count(DISTINCT source_id) FROM %s" % (table_name)).fetchone()
+
+class observed_parser(ck2_parser) :
+    # Counts the rows a reader sees at every line of the load
+    def __init__(self, dbconn, reader) :
+        ck2_parser.__init__(self, dbconn)
+        self.db.commit_interval = 1
+        self.reader = reader
+        self.seen = set()
+
+    def process_line(self, line) :
+        ck2_parser.process_line(self, line)
+        self.seen.add(count_rows(self.reader))
+
+class watch_test(unittest.TestCase) :
+    def setUp(self) :
+        self.directory = tempfile.mkdtemp()
+        self.saves = os.path.join(self.directory, "saves")
+        os.mkdir(self.saves)
+        self.output = os.path.join(self.directory, "output.db")
+
+    def tearDown(self) :
+        shutil.rmtree(self.directory)
+
+    def copy_save(self, source, name) :
+        path = os.path.join(self.saves, name)
+        shutil.copy(data_path(source), path)
+        return path
+
+    def test_reload_replaces_rows(self) :
+        path = self.copy_save("save_1066.ck2", "autosave.ck2")
+        with quiet() :
+            ingest_file(path, self.output)
+            ingest_file(path, self.output)
+        conn = sqlite3.connect(self.output)
+        self.assertEqual(count_rows(conn), (6, 1))
+
+        self.copy_save("save_1067.ck2", "autosave.ck2")
+        with quiet() :
+            ingest_file(path, self.output)
+        self.assertEqual(count_rows(conn), (7, 1))
+        self.assertEqual(count_rows(conn, "claim"), (1, 1))
+        self.assertEqual(conn.execute("SELECT title_id FROM claim").fetchone(), ("k_scotland",))
+
+    def test_reload_is_atomic(self) :
+        path = self.copy_save("save_1066.ck2", "autosave.ck2")
+        with quiet() :
+            ingest_file(path, self.output)
+        reader = sqlite3.connect(self.output)
+        self.copy_save("save_1067.ck2", "autosave.ck2")
+        parser = observed_parser(sqlite3.connect(self.output), reader)
+        with quiet() :
+            parser.parse_file(path)
+        # The earlier rows until the end of the load, never a part of both
+        self.assertEqual(parser.seen, set([(6, 1)]))
+        self.assertEqual(count_rows(reader), (7, 1))
+
+    def test_watch_with_options(self) :
+        # The output is created by the main process, like command_line does
+        with quiet() :
+            ck2_parser(sqlite3.connect(self.output), True, encode_strings = True)
+        self.copy_save("save_1066.ck2", "a.ck2")
+        self.copy_save("save_1067.ck2", "b.ck2")
+        watcher = ck2_watcher(self.saves, self.output, workers = 2, interval = 0.05, settle = 0,
+            encode_strings = True, checkpoint_elements = 5)
+        with quiet() :
+            watcher.run(cycles = 3)
+        self.assertEqual(watcher.failed, {})
+        self.assertEqual(len(watcher.ingested), 2)
+
+        conn = sqlite3.connect(self.output)
+        self.assertEqual(count_rows(conn, "character_data"), (13, 2))
+        self.assertEqual(conn.execute("SELECT count(*) FROM culture_lookup").fetchone()[0], 3)
+        self.assertEqual(conn.execute("SELECT DISTINCT culture FROM character ORDER BY 1").fetchall(),
+            [(None,), ("frankish",), ("saxon",)])
+
+        # A rewritten save replaces its rows
+        self.copy_save("save_1067.ck2", "a.ck2")
+        os.utime(os.path.join(self.saves, "a.ck2"), (0, 0))
+        watcher = ck2_watcher(self.saves, self.output, interval = 0.05, settle = 0,
+            encode_strings = True, checkpoint_elements = 5)
+        with quiet() :
+            watcher.run(cycles = 3)
+        self.assertEqual(count_rows(conn, "character_data"), (14, 2))
+
+if __name__ == "__main__":
+    unittest.main()